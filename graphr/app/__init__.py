@@ -1,35 +1,225 @@
-''' main app routes '''
-from flask import Flask
-from flask import render_template, request, session, redirect, url_for, flash
-from .neo import Neo_client
+''' main app routes and the app factory '''
+import csv
+import json
+import time
+import uuid
+import flask
+from flask import Flask, Blueprint, Response, stream_with_context, abort, current_app
+from flask import request, session, redirect, url_for, flash, g
+from werkzeug.local import LocalProxy
+from .neo import Neo_client, EXPORTS
+from . import bookmarks
+from .assets import AssetManifest
+from .templating import configure_templates
+from markupsafe import Markup
+from graphr.metrics import REGISTRY, REQUEST_SECONDS, TEMPLATE_SECONDS
+from graphr.logger import logger, request_id, setup_logging
+from graphr.argparser import get_pars
 from .forms import NewDeptForm, NewEmployeeForm, NewProjectForm
 from wtforms import Form, StringField, validators, TextAreaField, SelectField
 
 
-app = Flask(__name__)
-app.config['TEMPLATES_AUTO_RELOAD'] = True
-# max age of the cached static files in seconds
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 60
-app.static_folder = './static'
-app.secret_key = 'dumb_secret_key'
+NAVBAR_ITEMS = ['employees', 'departments', 'projects', 'structure', 'search']
+PAGE_SIZE_DEFAULT = 25
+PAGE_SIZE_MAX = 100
+# suggestions the typeahead endpoint returns
+TYPEAHEAD_LIMIT = 10
+# detail page of a search result by its kind, and the route argument its id goes in
+SEARCH_RESULT_VIEWS = {
+    'employee': ('views.employee_detail', 'id'),
+    'department': ('views.dept_detail', 'name'),
+    'project': ('views.project_detail', 'id'),
+}
+# session key of the bookmark of the user's last write
+BOOKMARKS_SESSION_KEY = 'neo_bookmarks'
+# longest pause between warm-up attempts while the database is unreachable
+WARM_UP_RETRY_MAX = 30
 
-NAVBAR_ITEMS = ['employees', 'departments', 'projects', 'structure']
+views = Blueprint('views', __name__)
 
-Neo = Neo_client()
+# the database client of the app handling the request
+Neo = LocalProxy(lambda: current_app.extensions['graphr.neo'])
 
 
-@app.context_processor
+def create_app(pars=None) -> Flask:
+    '''
+    builds the app from the parsed parameters, get_pars() when none are given
+    importing the package and building the app do no I/O, the database is
+    first touched by warm_up(), so every worker process gets its own driver
+    '''
+    pars = pars or get_pars()
+    setup_logging(pars)
+
+    app = Flask(__name__)
+    # max age of the cached static files in seconds, the fingerprinted ones are immutable
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 60
+    app.static_folder = './static'
+    app.secret_key = 'dumb_secret_key'
+    AssetManifest(app)
+
+    neo = Neo_client(pars)
+    app.extensions['graphr.neo'] = neo
+    app.extensions['graphr.ready'] = False
+    # the fragment cache is only there in production mode
+    app.extensions['graphr.fragments'] = configure_templates(app, pars.production, pars.template_cache_dir)
+    register_metrics(app)
+
+    from .api import api
+    app.register_blueprint(views)
+    app.register_blueprint(api)
+
+    return app
+
+
+def register_metrics(app):
+    ''' pool and cache metrics of the app's clients '''
+    neo = app.extensions['graphr.neo']
+    fragments = app.extensions['graphr.fragments']
+    REGISTRY.gauge('graphr_pool_connections', 'Pooled database connections by state',
+                   lambda: [({'state': state}, neo.pool_info()[state]) for state in ('in_use', 'idle')])
+    REGISTRY.callback_counter('graphr_pool_acquisitions_total', 'Connection acquisitions from the pool',
+                              lambda: neo.pool_info()['acquisitions'])
+    REGISTRY.callback_counter('graphr_pool_acquisition_failures_total', 'Failed connection acquisitions',
+                              lambda: neo.pool_info()['acquisition_failures'])
+    REGISTRY.callback_counter('graphr_pool_acquisition_wait_seconds_total', 'Total time spent waiting for a connection',
+                              lambda: neo.pool_info()['acquisition_wait_seconds_total'])
+    REGISTRY.callback_counter('graphr_cache_lookups_total', 'Choices cache lookups by result',
+                              lambda: [({'result': 'hit'}, neo.cache_info()['hits']),
+                                       ({'result': 'miss'}, neo.cache_info()['misses'])])
+    if fragments:
+        REGISTRY.callback_counter('graphr_fragment_cache_lookups_total', 'Rendered fragment cache lookups by result',
+                                  lambda: [({'result': 'hit'}, fragments.info()['hits']),
+                                           ({'result': 'miss'}, fragments.info()['misses'])])
+
+
+def warm_up(app):
+    '''
+    connects the app's client and primes it, retrying with a growing pause
+    while the database is unreachable; /readyz answers 503 until it is done
+    '''
+    delay = 1
+    while not app.extensions['graphr.neo'].warm_up():
+        logger.warning('Warm-up failed, next attempt in %ss', delay)
+        time.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_MAX)
+
+    app.extensions['graphr.ready'] = True
+    logger.info('Warm-up done, ready to serve')
+
+
+def render_template(template_name: str, **context):
+    ''' flask.render_template, timed into the template metrics '''
+    with TEMPLATE_SECONDS.time(template=template_name):
+        return flask.render_template(template_name, **context)
+
+
+@views.before_app_request
+def start_request():
+    '''
+    request timer, the request id stamped on every log record, the bookmark
+    of the user's last write, so the reads after a redirect see that write,
+    and the unit of work the Neo calls of the request share a session in
+    '''
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = request_id.set(g.request_id)
+    g.bookmarks = tuple(session.get(BOOKMARKS_SESSION_KEY, ()))
+    g.bookmarks_token = bookmarks.use(g.bookmarks)
+    g.unit_of_work_token = Neo.begin()
+
+
+@views.teardown_app_request
+def end_request(exc):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id.reset(token)
+    token = g.pop('unit_of_work_token', None)
+    if token is not None:
+        Neo.end(token)
+    token = g.pop('bookmarks_token', None)
+    if token is not None:
+        bookmarks.reset(token)
+
+
+@views.after_app_request
+def observe_request(response):
+    ''' route latency by url rule, so /employees/<id> is one series '''
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                route=route, method=request.method, status=response.status_code)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    # only a write changes them, reads leave the session cookie alone
+    if 'bookmarks' in g and bookmarks.current() != g.bookmarks:
+        session[BOOKMARKS_SESSION_KEY] = list(bookmarks.current())
+
+    return response
+
+
+@views.app_context_processor
 def inject_routes():
     """
     Registers the routes for the navbar into the app context
     This is needed because the parent template does not have
     its own route and can't be passed arguments
     """
-    links = [(item, item.capitalize()) for item in NAVBAR_ITEMS]
+    links = [(f'views.{item}', item.capitalize()) for item in NAVBAR_ITEMS]
     return(dict(links=links))
 
 
-@app.route("/")
+def get_page_args():
+    '''
+    cursor and page size of a list view from the query string
+    the page size is clamped so a client can't ask for the whole graph
+    '''
+    limit = request.args.get('limit', PAGE_SIZE_DEFAULT, type=int)
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+
+    return request.args.get('after'), limit
+
+
+def paginate(page_data: dict, key: str, rows: list, limit: int, sort_key) -> bool:
+    '''
+    fills a page of rows and the cursor of the next one into page_data
+    rows are expected to be fetched with limit + 1 to tell if there is a next page
+    returns False when the rows could not be loaded
+    '''
+    loaded = rows is not None and not isinstance(rows, str)
+    if not loaded:
+        flash('An unexpected error occured while processing your request', 'error')
+        rows = []
+
+    page_data[key] = rows[:limit]
+    page_data['limit'] = limit
+    page_data['after'] = request.args.get('after')
+    page_data['next'] = Neo.encode_cursor(*sort_key(rows[limit - 1])) if len(rows) > limit else None
+
+    return loaded
+
+
+def render_fragment(template_name: str, load, *key):
+    '''
+    renders a page fragment from the page_data returned by load()
+    in production mode the HTML is cached under the graph version, so until
+    the next write a hit skips both the queries in load() and the rendering
+    load() returns (page_data, loaded), failed loads are never cached
+    '''
+    fragments = current_app.extensions['graphr.fragments']
+    version = Neo.get_graph_version() if fragments else None
+    cache_key = (template_name, version) + key if version is not None else None
+    html = fragments.get(cache_key) if cache_key else None
+    if html is None:
+        page_data, loaded = load()
+        html = Markup(render_template(template_name, page_data=page_data))
+        if cache_key and loaded:
+            fragments.set(cache_key, html)
+
+    return html
+
+
+@views.route("/")
 def home():
     ''' 
     this will be an initial overview 
@@ -39,20 +229,53 @@ def home():
     return render_template('home.html')
 
 
+@views.route('/metrics', methods=['GET'])
+def metrics():
+    ''' query, route, template, pool and cache metrics for Prometheus '''
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@views.route('/status/pool', methods=['GET'])
+def pool_status():
+    ''' connection pool telemetry '''
+    return Neo.pool_info()
+
+
+@views.route('/healthz', methods=['GET'])
+def healthz():
+    ''' liveness, the process is up and answering '''
+    return {'status': 'ok'}
+
+
+@views.route('/readyz', methods=['GET'])
+def readyz():
+    ''' readiness, only once the warm-up went through, so no cold worker gets traffic '''
+    if not current_app.extensions['graphr.ready']:
+        return {'status': 'warming up'}, 503
+
+    return {'status': 'ready'}
+
+
 ##### EMPLOYEES
 
-@app.route('/employees', methods=['POST', 'GET'])
+@views.route('/employees', methods=['POST', 'GET'])
 def employees():
-    page_data = {}
-    page_data['table_header'] = ['name','department','position']
-    page_data['employees'] = Neo.get_all_employees()
+    after, limit = get_page_args()
+
+    def load():
+        page_data = {}
+        page_data['table_header'] = ['name','department','position']
+        rows = Neo.get_all_employees(after=after, limit=limit + 1)
+        return page_data, paginate(page_data, 'employees', rows, limit, lambda e: (e.get('surname'), e['id']))
 
-    return render_template('employees.html', page_data=page_data)
+    table = render_fragment('_employees_table.html', load, after, limit)
 
+    return render_template('employees.html', table=table)
 
-@app.route('/employees/add', methods=['POST', 'GET'])
+
+@views.route('/employees/add', methods=['POST', 'GET'])
 def new_employee():
-    choices = [dept['name'] for dept in Neo.get_all_depts()]
+    choices = Neo.get_dept_choices() or []
 
     form = NewEmployeeForm(request.form)
     form.department.choices = choices
@@ -75,11 +298,17 @@ def new_employee():
     return render_template('new_employee.html', form=form)
 
 
-@app.route('/employees/<string:id>/edit', methods=['POST', 'GET'])
+@views.route('/employees/<string:id>/edit', methods=['POST', 'GET'])
 def edit_employee(id):
-    dept_choices = [dept['name'] for dept in Neo.get_all_depts()]
-    proj_choices = [proj['name'] for proj in Neo.get_all_projects()]
-    initial_values = Neo.get_employee(id)
+    page = Neo.get_employee_edit_page(id)
+    if not page:
+        flash('An unexpected error occured while processing your request', 'error')
+        return redirect('/employees')
+
+    dept_choices = page['dept_choices']
+    # N/A first, so an employee without a project keeps none when saved
+    proj_choices = ['N/A'] + page['proj_choices']
+    initial_values = page['employee']
     #initial values hack
     class F(Form):
         pass
@@ -114,7 +343,7 @@ def edit_employee(id):
     pass
 
 
-@app.route('/employees/<string:id>/delete', methods=['POST', 'GET'])
+@views.route('/employees/<string:id>/delete', methods=['POST', 'GET'])
 def delete_employee(id):
     ''' employee delete '''
     if request.method == 'POST':
@@ -126,7 +355,7 @@ def delete_employee(id):
         return
 
 
-@app.route('/employees/<string:id>', methods=['POST', 'GET'])
+@views.route('/employees/<string:id>', methods=['POST', 'GET'])
 def employee_detail(id):
     page_data = {}
     page_data['order'] = ['id','surname','name','department','assigned','position','started','skills','note','project']
@@ -139,16 +368,22 @@ def employee_detail(id):
 
 ##### DEPARTMENTS
 
-@app.route('/departments', methods=['POST', 'GET'])
+@views.route('/departments', methods=['POST', 'GET'])
 def departments():
-    page_data = {}
-    page_data['table_header'] = ['name','description','Chief officer']
-    page_data['depts'] = Neo.get_all_depts()
+    after, limit = get_page_args()
+
+    def load():
+        page_data = {}
+        page_data['table_header'] = ['name','description','Chief officer']
+        rows = Neo.get_all_depts(after=after, limit=limit + 1)
+        return page_data, paginate(page_data, 'depts', rows, limit, lambda d: (d['name'],))
 
-    return render_template('departments.html', page_data=page_data)
+    table = render_fragment('_departments_table.html', load, after, limit)
 
+    return render_template('departments.html', table=table)
 
-@app.route('/departments/new', methods=['POST', "GET"])
+
+@views.route('/departments/new', methods=['POST', "GET"])
 def new_dept():
     ''' department creation '''
 
@@ -169,22 +404,25 @@ def new_dept():
     return render_template('new_dept.html', form=form)
 
 
-@app.route('/departments/<string:name>', methods=['GET'])
+@views.route('/departments/<string:name>', methods=['GET'])
 def dept_detail(name):
     ''' dept detail '''
 
     page_data = {}
     page_data['employees_header'] = ['name','position']
     page_data['projects_header'] = ['id', 'name']
-    page_data['employees'] = [employee for employee in Neo.get_all_employees() if employee['department']==name]
-    page_data['dept'] = Neo.get_dept(name)
-    if not page_data:
+    dept = Neo.get_dept_page(name)
+    if not dept:
         flash('An unexpected error occured while processing your request', 'error')
-    
+        return redirect('/departments')
+
+    page_data['employees'] = dept.pop('employees')
+    page_data['dept'] = dept
+
     return render_template('dept[name].html', page_data=page_data)
 
 
-@app.route('/departments/<string:name>/edit', methods=['GET','POST'])
+@views.route('/departments/<string:name>/edit', methods=['GET','POST'])
 def edit_dept(name):
     ''' dept edit '''
 
@@ -218,7 +456,7 @@ def edit_dept(name):
     return render_template('edit_dept.html', form=form)
 
 
-@app.route('/departments/<string:name>/delete', methods=['POST'])
+@views.route('/departments/<string:name>/delete', methods=['POST'])
 def delete_dept(name):
     ''' dept delete '''
     if request.method == 'POST':
@@ -231,37 +469,116 @@ def delete_dept(name):
         return
 
 
+##### EXPORT
+
+class _Line:
+    ''' file-like target that hands back what csv.writer writes '''
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns: list, rows):
+    ''' header and rows as CSV lines, one at a time '''
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([row[column] for column in columns])
+
+
+def ndjson_lines(rows):
+    ''' one JSON object per line '''
+    for row in rows:
+        yield json.dumps(row, default=str) + '\n'
+
+
+@views.route('/export/<string:kind>.<string:fmt>', methods=['GET'])
+def export(kind, fmt):
+    '''
+    streams all employees, departments or projects as CSV or NDJSON
+    rows go out as the driver reads them, nothing is collected in memory
+    '''
+    if kind not in EXPORTS or fmt not in ('csv', 'ndjson'):
+        abort(404)
+
+    columns, _ = EXPORTS[kind]
+    rows = Neo.stream_export(kind)
+    if fmt == 'csv':
+        body, mimetype = csv_lines(columns, rows), 'text/csv'
+    else:
+        body, mimetype = ndjson_lines(rows), 'application/x-ndjson'
+
+    return Response(stream_with_context(body),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+
 ##### STRUCTURE
 
-@app.route('/structure', methods=['POST', 'GET'])
+@views.route('/structure', methods=['POST', 'GET'])
 def structure():
     '''
     very basic structure overview
     '''
 
     data = Neo.get_aggregates()
+    if not data:
+        flash('An unexpected error occured while processing your request', 'error')
+        return redirect('/')
+
     data['saldo'] = data['newbies'] - data['terminated']
     
     return render_template('structure.html', page_data=data)
 
 
+##### SEARCH
+
+def result_url(row: dict) -> str:
+    ''' detail page URL of a search result '''
+    endpoint, argument = SEARCH_RESULT_VIEWS[row['kind']]
+    return url_for(endpoint, **{argument: row['id']})
+
+
+@views.route('/search', methods=['GET'])
+def search():
+    '''
+    ranked fulltext search over employees, departments and projects,
+    a single index query instead of scrolling the listings
+    '''
+    query = request.args.get('q', '').strip()
+    _, limit = get_page_args()
+    results = Neo.search(query, limit=limit)
+    if results is None:
+        flash('An unexpected error occured while processing your request', 'error')
+        results = []
+    for row in results:
+        row['url'] = result_url(row)
+
+    return render_template('search.html', query=query, results=results)
+
+
 ##### PROJECTS
 
-@app.route('/projects', methods=['POST', 'GET'])
+@views.route('/projects', methods=['POST', 'GET'])
 def projects():
-    page_data = {}
-    page_data['table_header'] = ['id','name','assigned']
-    page_data['projects'] =  Neo.get_all_projects()
+    after, limit = get_page_args()
+
+    def load():
+        page_data = {}
+        page_data['table_header'] = ['id','name','assigned']
+        rows = Neo.get_all_projects(after=after, limit=limit + 1)
+        return page_data, paginate(page_data, 'projects', rows, limit, lambda p: (p['id'],))
+
+    table = render_fragment('_projects_table.html', load, after, limit)
 
-    return render_template('projects.html', page_data=page_data)
+    return render_template('projects.html', table=table)
 
 
-@app.route('/projects/new', methods=['POST', "GET"])
+@views.route('/projects/new', methods=['POST', "GET"])
 def new_project():
     ''' project creation '''
 
 
-    choices = [dept['name'] for dept in Neo.get_all_depts()]
+    choices = Neo.get_dept_choices() or []
 
     form = NewProjectForm(request.form)
     form.department.choices = choices
@@ -282,21 +599,24 @@ def new_project():
     return render_template('new_project.html', form=form)
 
 
-@app.route('/projects/<string:id>', methods=['GET'])
+@views.route('/projects/<string:id>', methods=['GET'])
 def project_detail(id):
     ''' dept detail '''
 
     page_data = {}
     page_data['employees_header'] = ['name','position']
-    page_data['employees'] = [employee for employee in Neo.get_all_employees() if employee['project_id']==id]
-    page_data['project'] = Neo.get_project(id)
-    if not page_data:
+    project = Neo.get_project_page(id)
+    if not project:
         flash('An unexpected error occured while processing your request', 'error')
-    
+        return redirect('/projects')
+
+    page_data['employees'] = project.pop('employees')
+    page_data['project'] = project
+
     return render_template('proj[id].html', page_data=page_data)
 
 
-@app.route('/projects/<string:id>/delete', methods=['POST'])
+@views.route('/projects/<string:id>/delete', methods=['POST'])
 def delete_project(id):
     ''' project delete '''
     if request.method == 'POST':
@@ -306,4 +626,4 @@ def delete_project(id):
             return redirect('/projects')
 
         flash('An unexpected error occured while processing your request', 'error')
-        return
\ No newline at end of file
+        return
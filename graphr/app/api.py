@@ -0,0 +1,133 @@
+''' versioned JSON API '''
+
+import hashlib
+from functools import wraps
+from flask import Blueprint, current_app, jsonify, make_response, request, abort
+from . import Neo, get_page_args, result_url, TYPEAHEAD_LIMIT
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# sort keys of the list cursors, as in the HTML list views
+SORT_KEYS = {
+    'employees': lambda e: (e.get('surname'), e['id']),
+    'departments': lambda d: (d['name'],),
+    'projects': lambda p: (p['id'],),
+}
+
+
+def jsonable(value):
+    ''' driver values to plain JSON types, neo4j dates become ISO strings '''
+    if isinstance(value, dict):
+        return {key: jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if hasattr(value, 'iso_format'):
+        return value.iso_format()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+
+    return str(value)
+
+
+def conditional(view):
+    '''
+    strong ETag from the graph version and the requested URL
+    a matching If-None-Match gets 304 before the view and its queries run,
+    costing only the version lookup
+    '''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = Neo.get_graph_version()
+        if version is None:
+            return view(*args, **kwargs)
+
+        etag = hashlib.sha1(f'{version}:{request.full_path}'.encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+
+        return response
+
+    return wrapper
+
+
+def page(kind: str, rows: list, limit: int):
+    ''' a page of items and the cursor of the next one '''
+    if rows is None or isinstance(rows, str):
+        abort(500)
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        'items': jsonable(rows),
+        'next': Neo.encode_cursor(*SORT_KEYS[kind](rows[-1])) if more else None,
+    })
+
+
+@api.route('/employees', methods=['GET'])
+@conditional
+def employees():
+    after, limit = get_page_args()
+    return page('employees', Neo.get_all_employees(after=after, limit=limit + 1), limit)
+
+
+@api.route('/employees/<string:id>', methods=['GET'])
+@conditional
+def employee(id):
+    employee = Neo.get_employee(id)
+    if not employee:
+        abort(404)
+
+    return jsonify(jsonable(employee))
+
+
+@api.route('/departments', methods=['GET'])
+@conditional
+def departments():
+    after, limit = get_page_args()
+    return page('departments', Neo.get_all_depts(after=after, limit=limit + 1), limit)
+
+
+@api.route('/departments/<string:name>', methods=['GET'])
+@conditional
+def department(name):
+    dept = Neo.get_dept_page(name)
+    if not dept:
+        abort(404)
+
+    return jsonify(jsonable(dept))
+
+
+@api.route('/projects', methods=['GET'])
+@conditional
+def projects():
+    after, limit = get_page_args()
+    return page('projects', Neo.get_all_projects(after=after, limit=limit + 1), limit)
+
+
+@api.route('/projects/<string:id>', methods=['GET'])
+@conditional
+def project(id):
+    project = Neo.get_project_page(id)
+    if not project:
+        abort(404)
+
+    return jsonify(jsonable(project))
+
+
+@api.route('/typeahead', methods=['GET'])
+@conditional
+def typeahead():
+    ''' prefix matches of q for a search box, best first '''
+    rows = Neo.search(request.args.get('q', ''), limit=TYPEAHEAD_LIMIT, prefix=True)
+    if rows is None:
+        abort(500)
+    for row in rows:
+        row['url'] = result_url(row)
+
+    return jsonify({'items': jsonable(rows)})
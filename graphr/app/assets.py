@@ -0,0 +1,171 @@
+''' fingerprinted, precompressed static assets '''
+
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from flask import Response, abort, request, url_for
+from graphr.logger import logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_URL = '/assets'
+# a year, the longest max-age caches honour; the URL changes with the content anyway
+ASSETS_MAX_AGE = 31536000
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+COMPRESS_MIN_SIZE = 1024
+STATIC_REFERENCE = re.compile(r'''url_for\(\s*['"]static['"]\s*,\s*filename\s*=\s*['"]([^'"]+)['"]\s*\)''')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+SOURCE_MAP = re.compile(r'''(sourceMappingURL=)(\S+?)(\s*\*/)?$''', re.MULTILINE)
+
+
+class Asset:
+    ''' one fingerprinted file, its body and precompressed variants held in memory '''
+    def __init__(self, path: str, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()
+        root, ext = os.path.splitext(path)
+        self.path = path
+        self.hashed = f'{root}.{digest[:12]}{ext}'
+        self.etag = digest[:32]
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.encodings = {'identity': body}
+        if self.mimetype.startswith(COMPRESSIBLE) and len(body) >= COMPRESS_MIN_SIZE:
+            self._compress(body)
+
+    def _compress(self, body: bytes):
+        # only keep a variant that actually saves bytes
+        variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli:
+            variants['br'] = brotli.compress(body, quality=11)
+        for encoding, data in variants.items():
+            if len(data) < len(body):
+                self.encodings[encoding] = data
+
+    def negotiate(self, accept_encodings) -> str:
+        ''' the smallest variant the client accepts '''
+        accepted = [e for e in self.encodings if e == 'identity' or accept_encodings[e]]
+        return min(accepted, key=lambda e: len(self.encodings[e]))
+
+
+class AssetManifest:
+    '''
+    fingerprints the static files the templates reference, plus the files
+    their stylesheets point to, once at startup
+    the assets are served from memory under content hashed URLs marked
+    immutable, precompressed with gzip (and brotli when it is installed),
+    so a repeat page load fetches no static bytes at all
+    files are read at startup, restart the app to pick up an edited asset
+    '''
+    def __init__(self, app=None):
+        self.assets = {}
+        self.by_hash = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.static_url = app.static_url_path
+        for template in self._templates(app):
+            with open(template, encoding='utf-8') as fh:
+                for path in STATIC_REFERENCE.findall(fh.read()):
+                    self.add(path)
+
+        app.add_url_rule(f'{ASSETS_URL}/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['url_for'] = self.url_for
+        app.extensions['graphr.assets'] = self
+        logger.info('Fingerprinted %s static assets, brotli %s',
+                    len(self.assets), 'on' if brotli else 'off')
+
+    @staticmethod
+    def _templates(app) -> list:
+        folder = os.path.join(app.root_path, app.template_folder)
+        return [os.path.join(root, name)
+                for root, _, names in os.walk(folder)
+                for name in names if name.endswith('.html')]
+
+    def add(self, path: str):
+        ''' fingerprints a static file and everything its stylesheet references '''
+        path = os.path.normpath(path).replace(os.sep, '/')
+        if path in self.assets:
+            return self.assets[path]
+
+        full_path = os.path.join(self.static_folder, path)
+        if path.startswith('..') or not os.path.isfile(full_path):
+            return
+
+        with open(full_path, 'rb') as fh:
+            body = fh.read()
+        if path.endswith(('.css', '.js')):
+            body = self._rewrite(path, body)
+
+        asset = Asset(path, body)
+        self.assets[path] = asset
+        self.by_hash[asset.hashed] = asset
+
+        return asset
+
+    def _rewrite(self, path: str, body: bytes) -> bytes:
+        '''
+        points the relative references of a stylesheet at the hashed URLs,
+        files that can't be fingerprinted and source maps at the plain static URL
+        '''
+        base = os.path.dirname(path)
+        text = body.decode('utf-8')
+
+        def reference(target: str, hashed: bool) -> str:
+            if target.startswith(('/', 'data:', 'http:', 'https:', '#')):
+                return target
+            file, sep, suffix = self._split(target)
+            resolved = os.path.normpath(os.path.join(base, file)).replace(os.sep, '/')
+            asset = self.add(resolved) if hashed else None
+            if asset:
+                return f'{ASSETS_URL}/{asset.hashed}{sep}{suffix}'
+
+            return f'{self.static_url}/{resolved}{sep}{suffix}'
+
+        if path.endswith('.css'):
+            text = CSS_URL.sub(lambda m: f'url({m.group(1)}{reference(m.group(2), True)}{m.group(1)})', text)
+        text = SOURCE_MAP.sub(lambda m: f'{m.group(1)}{reference(m.group(2), False)}{m.group(3) or ""}', text)
+
+        return text.encode('utf-8')
+
+    @staticmethod
+    def _split(target: str) -> tuple:
+        ''' file part of a reference and its ?query or #fragment '''
+        match = re.search(r'[?#]', target)
+        if not match:
+            return target, '', ''
+
+        return target[:match.start()], match.group(), target[match.end():]
+
+    def url_for(self, endpoint: str, **values):
+        ''' url_for of the templates, static files resolve to their hashed URL '''
+        if endpoint == 'static':
+            asset = self.assets.get(values.get('filename'))
+            if asset:
+                values['filename'] = asset.hashed
+                endpoint = 'assets'
+
+        return url_for(endpoint, **values)
+
+    def serve(self, filename: str):
+        asset = self.by_hash.get(filename)
+        if not asset:
+            abort(404)
+
+        if request.if_none_match.contains(asset.etag):
+            response = Response(status=304)
+        else:
+            encoding = asset.negotiate(request.accept_encodings)
+            response = Response(asset.encodings[encoding], mimetype=asset.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(asset.etag)
+        response.headers['Cache-Control'] = f'public, max-age={ASSETS_MAX_AGE}, immutable'
+        response.headers['Vary'] = 'Accept-Encoding'
+
+        return response
@@ -0,0 +1,28 @@
+''' causal consistency bookmarks of the current request '''
+
+from contextvars import ContextVar
+
+# the bookmark of the newest write the current context has seen; reads pass it
+# on, so whichever server they are routed to waits until it has that write
+# the newest bookmark of a database covers the older ones, one is enough
+_bookmarks = ContextVar('graphr_bookmarks', default=())
+
+
+def current() -> tuple:
+    return _bookmarks.get()
+
+
+def use(marks):
+    ''' makes marks the bookmarks of the current context, returns the token to reset it with '''
+    return _bookmarks.set(tuple(marks or ())[-1:])
+
+
+def reset(token):
+    _bookmarks.reset(token)
+
+
+def add(mark: str):
+    ''' the bookmark a write session left behind, the reads after it chain on it '''
+    if mark:
+        _bookmarks.set((mark,))
+
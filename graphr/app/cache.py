@@ -0,0 +1,75 @@
+''' small in-process cache for rarely changing reference data '''
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTLCache:
+    '''
+    bounded LRU cache whose entries also expire after ttl seconds
+    callers drop the keys a write affects or put a version in the key, the
+    TTL only bounds how stale an entry can get when another process did the write
+    '''
+    def __init__(self, maxsize: int=128, ttl: float=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        ''' cached value of key, default if it is missing or expired '''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._data[key]
+            self.misses += 1
+
+            return default
+
+    def set(self, key, value):
+        ''' stores value, dropping the least recently used entry when full '''
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        '''
+        cached value of key, otherwise loader() is called and its result cached
+        a None result means the load failed and is not cached
+        '''
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+
+        return value
+
+    def invalidate(self, *keys):
+        ''' drops the given keys '''
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> dict:
+        ''' hit and miss counters and current size '''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+        }
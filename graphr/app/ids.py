@@ -0,0 +1,63 @@
+''' ID allocation for graph nodes '''
+
+import os
+import time
+from abc import ABC, abstractmethod
+from threading import Lock
+
+# Crockford base32, keeps the lexical order of the encoded number
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+RANDOM_BITS = 80
+
+
+class IdAllocator(ABC):
+    '''
+    base of the pluggable ID allocators used by Neo_client
+    an allocator hands out unique IDs that sort in order of creation,
+    so no lookup is needed before an insert and the IDs work as page cursors
+    '''
+    @abstractmethod
+    def new_id(self) -> str:
+        ''' returns a single new ID '''
+
+    def new_ids(self, count: int) -> list:
+        ''' returns a block of new IDs, for bulk writes '''
+        return [self.new_id() for _ in range(count)]
+
+
+class UlidAllocator(IdAllocator):
+    '''
+    ULID style IDs: 48 bits of unix time in ms followed by 80 random bits,
+    encoded as 26 base32 characters
+    within the same ms the random part is incremented instead of redrawn,
+    so the IDs of one process are strictly increasing
+    '''
+    def __init__(self):
+        self._lock = Lock()
+        self._last_ms = 0
+        self._last_random = 0
+
+    def new_id(self) -> str:
+        with self._lock:
+            ms = time.time_ns() // 1_000_000
+            if ms > self._last_ms:
+                rand = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+            else:
+                # same ms (or the clock went back), keep counting from the last ID
+                ms = self._last_ms
+                rand = self._last_random + 1
+                if rand >> RANDOM_BITS:
+                    ms, rand = ms + 1, 0
+            self._last_ms, self._last_random = ms, rand
+
+        return self.encode((ms << RANDOM_BITS) | rand)
+
+    @staticmethod
+    def encode(value: int) -> str:
+        ''' 128 bit int to 26 base32 characters '''
+        chars = []
+        for _ in range(26):
+            chars.append(ALPHABET[value & 31])
+            value >>= 5
+
+        return ''.join(reversed(chars))
@@ -1,31 +1,397 @@
 ''' database connection object '''
 
-from datetime import datetime
-from secrets import randbelow
-from neo4j import GraphDatabase
+import json
+import re
+import time
+import warnings
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import date, datetime
+from functools import wraps
+from threading import Lock
+import gevent
+from neo4j import GraphDatabase, ExperimentalWarning, READ_ACCESS, WRITE_ACCESS
 from graphr.logger import logger
-from graphr.argparser import Pars
+from .ids import IdAllocator, UlidAllocator
+from .cache import TTLCache
+from . import bookmarks
+from .pool import PoolMetrics
+from .profiler import QueryProfiler, RecordingTransaction
+from graphr.metrics import QUERY_SECONDS, QUERY_ROWS
+
+# department and project names for form choices, keyed by the graph version
+CHOICES_CACHE_SIZE = 16
+CHOICES_CACHE_TTL = 300
+# bumped by every write, the API derives its ETags from it
+GRAPH_VERSION_COUNTER = 'graph_version'
+# employee properties the edit form writes
+EDIT_FIELDS = ('name', 'surname', 'position', 'skills', 'note')
+# relationships compact_relationships() deduplicates, by the label of their start
+# node and the unique key the batches walk that label by
+COMPACT_RELATIONSHIPS = {
+    'Employee': ('id', ['WORKS_IN', 'DIRECTS', 'ASSIGNED_TO']),
+    'Department': ('name', ['OWNS']),
+}
+
+# rows pulled from the server per round trip while streaming an export
+EXPORT_FETCH_SIZE = 500
+
+# constraints and indexes the lookups below rely on, keyed by their name in the db
+# uniqueness constraints come with an index of the same name
+SCHEMA = {
+    'employee_id': 'CREATE CONSTRAINT employee_id IF NOT EXISTS FOR (e:Employee) REQUIRE e.id IS UNIQUE',
+    'department_name': 'CREATE CONSTRAINT department_name IF NOT EXISTS FOR (d:Department) REQUIRE d.name IS UNIQUE',
+    'project_id': 'CREATE CONSTRAINT project_id IF NOT EXISTS FOR (p:Project) REQUIRE p.id IS UNIQUE',
+    'project_name': 'CREATE INDEX project_name IF NOT EXISTS FOR (p:Project) ON (p.name)',
+    'employee_surname': 'CREATE INDEX employee_surname IF NOT EXISTS FOR (e:Employee) ON (e.surname)',
+    'employee_started': 'CREATE INDEX employee_started IF NOT EXISTS FOR (e:Employee) ON (e.started)',
+    'counter_name': 'CREATE CONSTRAINT counter_name IF NOT EXISTS FOR (c:Counter) REQUIRE c.name IS UNIQUE',
+    'employee_search': ('CREATE FULLTEXT INDEX employee_search IF NOT EXISTS FOR (e:Employee) '
+                        'ON EACH [e.name, e.surname, e.skills, e.note]'),
+    'department_search': ('CREATE FULLTEXT INDEX department_search IF NOT EXISTS FOR (d:Department) '
+                          'ON EACH [d.name, d.description]'),
+    'project_search': ('CREATE FULLTEXT INDEX project_search IF NOT EXISTS FOR (p:Project) '
+                       'ON EACH [p.name, p.client, p.description]'),
+}
+
+# the words of a search, split like the fulltext analyzer splits the indexed text;
+# wildcard terms skip the analyzer, so punctuation never reaches the query
+SEARCH_WORD = re.compile(r'\w+')
+# one statement over the three fulltext indexes; each index hands out its best
+# matches first, so the LIMIT inside a branch stops reading it early
+SEARCH_QUERY = '''
+    CALL {
+        CALL db.index.fulltext.queryNodes('employee_search', $query) YIELD node, score
+        WITH node, score LIMIT $limit
+        RETURN 'employee' AS kind, node.id AS id,
+               trim(coalesce(node.name, '') + ' ' + coalesce(node.surname, '')) AS label,
+               node.position AS detail, score
+        UNION ALL
+        CALL db.index.fulltext.queryNodes('department_search', $query) YIELD node, score
+        WITH node, score LIMIT $limit
+        RETURN 'department' AS kind, node.name AS id, node.name AS label,
+               node.description AS detail, score
+        UNION ALL
+        CALL db.index.fulltext.queryNodes('project_search', $query) YIELD node, score
+        WITH node, score LIMIT $limit
+        RETURN 'project' AS kind, node.id AS id, node.name AS label,
+               node.client AS detail, score
+    }
+    RETURN kind, id, label, detail, score
+    ORDER BY score DESC
+    LIMIT $limit
+'''
+
+# flat export queries; neighbours come from pattern comprehensions so no
+# aggregation forces the server to build the whole result before the first row
+EXPORTS = {
+    'employees': (
+        ['id', 'surname', 'name', 'position', 'skills', 'note', 'started', 'department', 'project_id', 'project'],
+        '''
+        MATCH (e:Employee)
+        WHERE e.id IS NOT NULL
+        WITH e, head([(e)-[:ASSIGNED_TO]->(p:Project) | p]) AS p
+        RETURN e.id AS id, e.surname AS surname, e.name AS name, e.position AS position,
+               e.skills AS skills, e.note AS note, toString(e.started) AS started,
+               head([(e)-[:WORKS_IN|DIRECTS]->(d:Department) | d.name]) AS department,
+               p.id AS project_id, p.name AS project
+        ORDER BY e.id
+        '''
+    ),
+    'departments': (
+        ['id', 'name', 'description', 'director_id'],
+        '''
+        MATCH (d:Department)
+        WHERE d.name IS NOT NULL
+        RETURN d.id AS id, d.name AS name, d.description AS description,
+               head([(d)<-[:DIRECTS]-(e:Employee) | e.id]) AS director_id
+        ORDER BY d.name
+        '''
+    ),
+    'projects': (
+        ['id', 'name', 'client', 'description', 'department', 'since'],
+        '''
+        MATCH (p:Project)
+        WHERE p.id IS NOT NULL
+        WITH p, head([(p)<-[o:OWNS]-(d:Department) | [d.name, o.since]]) AS owner
+        RETURN p.id AS id, p.name AS name, p.client AS client, p.description AS description,
+               owner[0] AS department, toString(owner[1]) AS since
+        ORDER BY p.id
+        '''
+    ),
+}
+
+# the unit of work of the current context, see Neo_client.begin()
+_unit_of_work = ContextVar('graphr_unit_of_work', default=None)
+
+
+class _UnitOfWork:
+    ''' the session the calls of one client share, opened on first use '''
+    def __init__(self, client):
+        self.client = client
+        self.session = None
+
+
+def driver_config(pars) -> dict:
+    ''' driver pool settings from the parsed parameters '''
+    return {
+        'max_connection_pool_size': pars.neo_max_pool_size,
+        'connection_acquisition_timeout': pars.neo_acquisition_timeout,
+        'max_connection_lifetime': pars.neo_max_lifetime,
+        'keep_alive': pars.neo_keep_alive,
+        'fetch_size': pars.neo_fetch_size,
+    }
+
+
+def instrumented(func=None, *, write: bool=False):
+    '''
+    times a transaction function into the query metrics, labelled by its name
+    an exception counts as a failure and is re-raised, so the driver retries
+    the transient ones; list results count as rows
+    the queries it runs are recorded and handed to the slow query profiler,
+    write=True marks the functions that change the graph, the profiler only
+    EXPLAINs those
+    '''
+    if func is None:
+        return lambda func: instrumented(func, write=write)
+
+    name = func.__name__.lstrip('_')
+
+    @wraps(func)
+    def wrapper(self, tx, *args, **kwargs):
+        tx = RecordingTransaction(tx)
+        start = time.perf_counter()
+        outcome = 'failure'
+        try:
+            result = func(self, tx, *args, **kwargs)
+            outcome = 'success'
+            if isinstance(result, list):
+                QUERY_ROWS.inc(len(result), query=name)
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            QUERY_SECONDS.observe(seconds, query=name, outcome=outcome)
+            self.profiler.observe(name, seconds, tx.queries, write)
+
+    return wrapper
+
+
+class GuardedSession:
+    '''
+    session proxy for the Neo_client methods: a transaction function that
+    still fails once the driver stops retrying is logged and returns None,
+    the methods report a failure by that return value
+    '''
+    def __init__(self, session):
+        self._session = session
+
+    def read_transaction(self, fn, *args, **kwargs):
+        return self._guarded(self._session.read_transaction, fn, *args, **kwargs)
+
+    def write_transaction(self, fn, *args, **kwargs):
+        return self._guarded(self._session.write_transaction, fn, *args, **kwargs)
+
+    @staticmethod
+    def _guarded(run, fn, *args, **kwargs):
+        try:
+            return run(fn, *args, **kwargs)
+        except Exception as e:
+            # _versioned runs the transaction function it is handed first
+            target = args[0] if fn.__name__ == '_versioned' else fn
+            logger.critical('Failed to execute a query; %s, exception: %s', target.__name__.lstrip('_'), e)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
 
-NEO_URI = Pars.neo_uri
-NEO_LOGIN = Pars.neo_login
-NEO_PASSWORD = Pars.neo_password
 
 class Neo_client:
-    def __init__(self):
-        self.driver = GraphDatabase.driver(uri=NEO_URI, auth=(NEO_LOGIN, NEO_PASSWORD))
+    '''
+    constructing the client does no I/O, the driver is created on first use,
+    so a forked worker builds its own connection pool; warm_up() connects
+    '''
+    def __init__(self, pars, id_allocator: IdAllocator=None):
+        self.pars = pars
+        self.id_allocator = id_allocator or UlidAllocator()
+        self.cache = TTLCache(maxsize=CHOICES_CACHE_SIZE, ttl=CHOICES_CACHE_TTL)
+        self.pool = self.profiler = None
+        self._driver = None
+        self._driver_lock = Lock()
+
+    @property
+    def driver(self):
+        ''' the neo4j driver with its pool telemetry and profiler, created on first use '''
+        if self._driver is None:
+            with self._driver_lock:
+                if self._driver is None:
+                    pars = self.pars
+                    driver = GraphDatabase.driver(uri=pars.neo_uri, auth=(pars.neo_login, pars.neo_password),
+                                                  **driver_config(pars))
+                    self.pool = PoolMetrics(driver)
+                    self.profiler = QueryProfiler(driver, slow_ms=pars.slow_query_ms,
+                                                  sample_rate=pars.profile_sample_rate, log_path=pars.profile_log)
+                    self._driver = driver
+
+        return self._driver
 
     def close(self):
-        self.driver.close()
+        if self._driver is not None:
+            self._driver.close()
+
+    def begin(self):
+        '''
+        starts a unit of work in the current context: the calls below share one
+        session, opened by the first of them, until end() closes it
+        returns the token to hand to end()
+        '''
+        return _unit_of_work.set(_UnitOfWork(self))
+
+    def end(self, token):
+        unit = _unit_of_work.get()
+        _unit_of_work.reset(token)
+        if unit is not None and unit.session is not None:
+            unit.session.close()
+
+    @contextmanager
+    def unit_of_work(self):
+        ''' begin() and end() around a block '''
+        token = self.begin()
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def concurrently(self, *calls) -> list:
+        '''
+        runs independent reads side by side, each in a greenlet and a session
+        of its own, so under the gevent server a page waits for the slowest
+        read instead of all of them in a row; the calls see the bookmarks of
+        the caller but not its unit of work, greenlets can't share a session
+        returns the results of the calls in their order
+        '''
+        def run(call):
+            _unit_of_work.set(None)
+            return call()
+
+        greenlets = [gevent.spawn(copy_context().run, run, call) for call in calls]
+        gevent.joinall(greenlets, raise_error=True)
+
+        return [greenlet.value for greenlet in greenlets]
+
+    def _read(self, fn, *args):
+        ''' a read transaction function in a session of its own '''
+        with self.session() as session:
+            return session.read_transaction(fn, *args)
+
+    @contextmanager
+    def session(self, access_mode: str=READ_ACCESS, **config):
+        '''
+        a driver session chained on the bookmarks of the current context
+        with a neo4j:// URI reads go to followers and read replicas, the
+        bookmark makes them wait until the server has the user's own writes;
+        a write session leaves its bookmark behind for the reads after it
+        inside a unit of work the shared session is handed out instead,
+        unless the caller asks for a session config of its own
+        '''
+        unit = _unit_of_work.get()
+        if unit is None or unit.client is not self or config:
+            with self.driver.session(default_access_mode=access_mode,
+                                     bookmarks=bookmarks.current(), **config) as session:
+                yield GuardedSession(session)
+                if access_mode == WRITE_ACCESS:
+                    bookmarks.add(session.last_bookmark())
+            return
+
+        if unit.session is None:
+            # transaction functions pick the server by their own access mode,
+            # the default only routes session.run, which the schema writes use
+            unit.session = self.driver.session(default_access_mode=WRITE_ACCESS,
+                                               bookmarks=bookmarks.current())
+        yield GuardedSession(unit.session)
+        if access_mode == WRITE_ACCESS:
+            bookmarks.add(unit.session.last_bookmark())
+
+    def warm_up(self) -> bool:
+        '''
+        connects, creates the missing schema and primes the pool, the graph
+        version lookup and the choices cache, so the first requests don't pay for it
+        returns True once the database answered all of it
+        '''
+        try:
+            with warnings.catch_warnings():
+                # flagged experimental in the 4.4 driver
+                warnings.simplefilter('ignore', ExperimentalWarning)
+                self.driver.verify_connectivity()
+        except Exception as e:
+            logger.critical('Database connectivity check failed, exception: %s', e)
+            return False
+
+        self.ensure_schema()
+        primed = [self.get_graph_version(), self.get_dept_choices(), self.get_project_choices()]
+
+        return all(value is not None for value in primed)
+
+    def pool_info(self) -> dict:
+        ''' live connection pool numbers '''
+        # the pool telemetry comes with the driver
+        self.driver
+        return self.pool.info()
+
+    def cache_info(self) -> dict:
+        ''' hit and miss counters of the choices cache '''
+        return self.cache.info()
     
-    @staticmethod
-    def new_id(length: int=3) -> str:
-        ''' returns a pseudo-random ID '''
-        id = ''
-        for _ in range(length):
-            num = str(randbelow(10))
-            id = id+num
-        
-        return id
+    def ensure_schema(self) -> list:
+        '''
+        creates the constraints and indexes from SCHEMA, existing ones are left alone
+        returns the names of those still missing or not online afterwards
+        '''
+        with self.session(WRITE_ACCESS) as session:
+            for name, statement in SCHEMA.items():
+                try:
+                    # schema changes can't share a transaction with anything else
+                    session.run(statement).consume()
+                except Exception as e:
+                    logger.critical('Failed to create schema item %s, exception: %s', name, e)
+
+        missing = self.missing_schema()
+        if missing:
+            logger.warning('Schema items missing or not online: %s', ', '.join(missing))
+        else:
+            logger.info('Schema in place: %s', ', '.join(SCHEMA))
+
+        return missing
+
+
+    def missing_schema(self) -> list:
+        ''' names from SCHEMA that are not present and online in the db '''
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_schema
+            )
+            if r is None:
+                logger.critical('Schema lookup failed miserably.')
+                return list(SCHEMA)
+
+            online = {row['name'] for row in r if row['state'] == 'ONLINE'}
+
+            return [name for name in SCHEMA if name not in online]
+
+
+    @instrumented
+    def _get_schema(self, tx):
+        query = (
+            '''
+            SHOW INDEXES YIELD name, state
+            RETURN name, state
+            '''
+        )
+        result = tx.run(query)
+        return [record for record in result]
+
+    def new_id(self) -> str:
+        ''' returns a unique, time-ordered ID from the configured allocator '''
+        return self.id_allocator.new_id()
 
     @staticmethod
     def get_date(month: bool=False) -> str:
@@ -34,14 +400,116 @@ class Neo_client:
 
         return datetime.now().strftime(format)
 
+    @staticmethod
+    def get_period(period: str='month', day: date=None) -> tuple:
+        '''
+        first day of the month, quarter or year that day falls in
+        and first day of the next one, as ISO strings for date()
+        '''
+        day = day or date.today()
+        if period == 'year':
+            span, first_month = 12, 1
+        elif period == 'quarter':
+            span, first_month = 3, 3 * ((day.month - 1) // 3) + 1
+        else:
+            span, first_month = 1, day.month
+        start = date(day.year, first_month, 1)
+        months = start.month - 1 + span
+        end = date(start.year + months // 12, months % 12 + 1, 1)
+
+        return start.isoformat(), end.isoformat()
+
+    @classmethod
+    def terminated_counter(cls) -> str:
+        ''' name of the counter of employees deleted this month '''
+        return 'terminated:' + cls.get_date()[:7]
+
+    def _increment_counter(self, tx, name: str, by: int=1):
+        '''
+        bumps a (:Counter) node within the calling write transaction
+        counters keep the stats that can't be read back from the graph later,
+        like how many employees were deleted
+        '''
+        query = (
+            '''
+            MERGE (c:Counter {name: $name})
+            ON CREATE SET c.value = 0
+            SET c.value = c.value + $by
+            RETURN c.value AS value
+            '''
+        )
+        return tx.run(query, name=name, by=by).single()
+
+    def _versioned(self, tx, fn, *args, **kwargs):
+        '''
+        runs a write transaction function and bumps the graph version
+        in the same transaction when it went through and its queries changed
+        the graph, a write that matched nothing leaves the caches valid
+        '''
+        tx = RecordingTransaction(tx)
+        result = fn(tx, *args, **kwargs)
+        if result is not None and tx.contains_updates():
+            self._increment_counter(tx, GRAPH_VERSION_COUNTER)
+
+        return result
+
+    def get_graph_version(self):
+        '''
+        current graph version, a number that grows with every write
+        a single index seek, cheap enough to run before a cached response is reused
+        '''
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_counter, GRAPH_VERSION_COUNTER
+            )
+            if r is None:
+                logger.critical('Graph version lookup failed miserably.')
+                return
+
+            return r[0]['value'] if r else 0
+
+    @instrumented
+    def _get_counter(self, tx, name: str):
+        query = (
+            '''
+            MATCH (c:Counter {name: $name})
+            RETURN c.value AS value
+            '''
+        )
+        result = tx.run(query, name=name)
+        return [record for record in result]
+
+    @staticmethod
+    def encode_cursor(*values) -> str:
+        ''' opaque keyset cursor made of the sort key of the last row on a page '''
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str, size: int) -> list:
+        ''' sort key values carried by a cursor, Nones if there is none or it is mangled '''
+        if cursor:
+            try:
+                values = json.loads(urlsafe_b64decode(cursor.encode()))
+                if isinstance(values, list) and len(values) == size:
+                    return values
+            except ValueError:
+                logger.warning('Ignoring invalid page cursor %s', cursor)
+
+        return [None] * size
+
+    @staticmethod
+    def _limit_clause(limit: int) -> str:
+        ''' LIMIT for paged queries, none when the whole list is wanted '''
+        return 'LIMIT $limit' if limit else ''
+
 
     def create_dept(self, dept: dict):
         ''' create department driver interaction '''
         name = dept.get('name')
         description = dept.get('description')
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._create_and_return_dept, name, description
+                self._versioned, self._create_and_return_dept, name, description
             )
             if not r:
                 logger.critical('Department creation failed miserably.')
@@ -50,6 +518,7 @@ class Neo_client:
         return True
 
     
+    @instrumented(write=True)
     def _create_and_return_dept(self, tx, name: str, description: str):
         ''' create department query '''
         id = self.new_id()
@@ -59,23 +528,25 @@ class Neo_client:
             RETURN d
             '''
         )
-        try:
-            result = tx.run(query, name=name, id=id, description=description)
-            logger.info('Created department %s, id: %s', name, id)
-            return result
+        result = tx.run(query, name=name, id=id, description=description)
+        logger.info('Created department %s, id: %s', name, id)
+        return result
 
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
 
     
-    def get_all_depts(self):
-        ''' get a list of all departments '''
+    def get_all_depts(self, after: str=None, limit: int=None):
+        '''
+        get a list of departments ordered by name
+        pass the cursor of the previous page as after and a page size as limit,
+        leave both out for the whole list
+        '''
         depts = []
-        with self.driver.session() as session:
+        after_name, = self.decode_cursor(after, 1)
+        with self.session() as session:
             r = session.read_transaction(
-                self._get_all_depts
+                self._get_all_depts, after_name, limit
             )
-            if not r:
+            if r is None:
                 logger.critical('Departments overview lookup failed miserably.')
                 return "internal server error"
             for row in r:
@@ -85,27 +556,74 @@ class Neo_client:
                 dept['director'] = director
                 depts.append(dept)
             
-            for dept in depts:
-                logger.critical(dept)
+            logger.debug('Departments page: %s rows', len(depts))
             return depts
 
 
-    def _get_all_depts(self, tx) -> list:
+    @instrumented
+    def _get_all_depts(self, tx, after_name: str, limit: int) -> list:
+        where = 'WHERE d.name > $after_name' if after_name is not None else ''
         query = (
-            "MATCH (d:Department)"
-            "OPTIONAL MATCH (d:Department)<-[r:DIRECTS]-(e:Employee)"
-            "RETURN d, e"
+            f'''
+            MATCH (d:Department)
+            {where}
+            WITH d ORDER BY d.name
+            {self._limit_clause(limit)}
+            OPTIONAL MATCH (d)<-[:DIRECTS]-(e:Employee)
+            WITH d, head(collect(e)) AS e
+            RETURN d, e
+            ORDER BY d.name
+            '''
         )
-        try:
-            result = tx.run(query)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, after_name=after_name, limit=limit)
+        return [record for record in result]
+
+
+    def _cached_choices(self, key: str, loader):
+        '''
+        choices cached under the graph version, so a write in any worker
+        process outdates them; loaded uncached when the version lookup fails
+        '''
+        version = self.get_graph_version()
+        if version is None:
+            return loader()
+
+        return self.cache.get_or_load((key, version), loader)
+
+    def get_dept_choices(self) -> list:
+        ''' department names for form choices, cached '''
+        return self._cached_choices('depts', self._load_dept_choices)
+
+
+    def _load_dept_choices(self):
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_names, 'Department'
+            )
+            if r is None:
+                logger.critical('Department choices lookup failed miserably.')
+                return
+
+            return [row['name'] for row in r]
+
+
+    @instrumented
+    def _get_names(self, tx, label: str):
+        # label comes from the callers above, never from user input
+        query = (
+            f'''
+            MATCH (n:{label})
+            RETURN n.name AS name
+            ORDER BY name
+            '''
+        )
+        result = tx.run(query)
+        return [record for record in result]
 
 
     def get_dept(self, name: str):
         ''' get details of a particular department '''
-        with self.driver.session() as session:
+        with self.session() as session:
             r = session.read_transaction(
                 self._get_dept,
                 name
@@ -114,40 +632,78 @@ class Neo_client:
                 logger.critical('Department detail lookup failed miserably.')
                 return 
 
-            projects = []
+            data = r[0].data()
+            dept = data['d']
+            dept['projects'] = data['projects']
 
-            for row in r:
-                data = row.data()
-                dept = data['d']
-                projects.append(data['p'])
-            
-            dept['projects'] = projects
-            
             return dept
 
 
+    @instrumented
     def _get_dept(self, tx, name: str):
         query = (
             '''
             MATCH (d:Department {name: $name})
-            OPTIONAL MATCH (d)-[:OWNS]->(p:Project)
-            RETURN d, p
+            RETURN d, [(d)-[:OWNS]->(p:Project) | p] AS projects
             '''
         )
-        try:
-            result = tx.run(query, name=name)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, name=name)
+        return [record for record in result]
+
+
+    def get_dept_page(self, name: str):
+        '''
+        department detail page in one statement:
+        the department with its projects and its employees
+        '''
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_dept_page,
+                name
+            )
+            if not r:
+                logger.critical('Department page lookup failed miserably.')
+                return
+
+            data = r[0].data()
+            dept = data['d']
+            dept['projects'] = data['projects']
+            dept['employees'] = data['employees']
+
+            return dept
+
+
+    @instrumented
+    def _get_dept_page(self, tx, name: str):
+        query = (
+            '''
+            MATCH (d:Department {name: $name})
+            CALL {
+                WITH d
+                MATCH (d)-[:OWNS]->(p:Project)
+                WITH DISTINCT p ORDER BY p.id
+                RETURN collect(p) AS projects
+            }
+            CALL {
+                WITH d
+                MATCH (d)<--(e:Employee)
+                WITH DISTINCT e ORDER BY e.surname, e.id
+                RETURN collect(e) AS employees
+            }
+            RETURN d, projects, employees
+            '''
+        )
+        result = tx.run(query, name=name)
+        return [record for record in result]
 
 
     def delete_dept(self, name):
         '''
         department deletion
         '''
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._delete_dept,
+                self._versioned, self._delete_dept,
                 name
             )
             if not r:
@@ -156,6 +712,7 @@ class Neo_client:
             return True
 
 
+    @instrumented(write=True)
     def _delete_dept(self, tx, name: str):
         query = (
             '''
@@ -165,11 +722,8 @@ class Neo_client:
             DELETE d
             '''
         )
-        try:
-            result = tx.run(query, name=name)
-            return result
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, name=name)
+        return result
 
 
     def edit_dept(self, dept, name):
@@ -177,9 +731,9 @@ class Neo_client:
 
         new_name = dept['name']
         new_description = dept['description']
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._edit_dept,
+                self._versioned, self._edit_dept,
                 name, new_name, new_description
             )
         if not r:
@@ -189,17 +743,15 @@ class Neo_client:
         return True
 
 
+    @instrumented(write=True)
     def _edit_dept(self, tx, name, new_name, new_description):
         query = (
             "MATCH (d:Department {name: $name})"
             "SET d += {name: $new_name, description: $new_description}"
             "RETURN d"
         )
-        try:
-            result = tx.run(query, name=name, new_name=new_name, new_description=new_description)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, name=name, new_name=new_name, new_description=new_description)
+        return [record for record in result]
 
 
     def add_employee(self, employee):
@@ -212,9 +764,9 @@ class Neo_client:
         skills = employee['skills']
         note = employee['note']
 
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._add_employee,
+                self._versioned, self._add_employee,
                 surname=surname, name=name, position=position, department=department, skills=skills, note=note
             )
         if not r:
@@ -224,14 +776,15 @@ class Neo_client:
         return True
 
 
+    @instrumented(write=True)
     def _add_employee(self, tx, surname: str, name: str, position: str, department: str, skills: str, note: str):
-        id = self.new_id(6)
+        id = self.new_id()
         assigned = self.get_date()
         #stupid fckng neo4j driver syntax shenanigans
         if position=='director':
             query = (
                 '''
-                CREATE (e:Employee {name: $name, surname: $surname, position: $position, skills: $skills, note: $note, id:$id, started: $assigned})
+                CREATE (e:Employee {name: $name, surname: $surname, position: $position, skills: $skills, note: $note, id:$id, started: date($assigned)})
                 WITH e
                 MATCH (d:Department {name: $department})
                 MERGE (e)-[r:DIRECTS]->(d)
@@ -243,7 +796,7 @@ class Neo_client:
         else:
              query = (
                 '''
-                CREATE (e:Employee {name: $name, surname: $surname, position: $position, skills: $skills, note: $note, id:$id, started: $assigned})
+                CREATE (e:Employee {name: $name, surname: $surname, position: $position, skills: $skills, note: $note, id:$id, started: date($assigned)})
                 WITH e
                 MATCH (d:Department {name: $department})
                 MERGE (e)-[r:WORKS_IN]->(d)
@@ -252,106 +805,124 @@ class Neo_client:
                 RETURN e
                 '''
             )
-        try:
-            result = tx.run(query,
-                        name=name, 
-                        surname=surname,
-                        position=position,
-                        department=department,
-                        skills=skills,
-                        note=note,
-                        id=id,
-                        assigned=assigned)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
-
-
-    def edit_employee(self, id:str, employee: dict):
-        ''' 
+        result = tx.run(query,
+                    name=name, 
+                    surname=surname,
+                    position=position,
+                    department=department,
+                    skills=skills,
+                    note=note,
+                    id=id,
+                    assigned=assigned)
+        return [record for record in result]
+
+
+    def edit_employee(self, id: str, employee: dict):
+        '''
         edits employee details
+        only what differs from the stored employee gets written
         '''
-        name = employee['name']
-        surname = employee['surname']
-        position = employee['position']
-        department = employee['department']
-        skills = employee['skills']
-        note = employee['note']
-        project = employee['project']
-
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._edit_employee,
-                id=id, surname=surname, name=name, position=position, department=department, skills=skills, note=note, projname=project
+                self._versioned, self._edit_employee,
+                id=id, employee=employee
             )
-        if not r:
-            logger.critical('Department editing failed miserably.')
+        if r is None:
+            logger.critical('Employee editing failed miserably.')
             return False
 
+        logger.debug('Employee %s edited, changed: %s', id, ', '.join(r) or 'nothing')
         return True
 
 
-    def _edit_employee(self, tx, id: str, surname: str, name: str, position: str, department: str, skills: str, note: str, projname: str):
-        assigned = self.get_date()
-        if position == 'director':
-            query = (
-                '''
-                MATCH (e:Employee {id: $id})
-                SET e += {name: $name, surname: $surname, position: $position, skills: $skills, note: $note, id:$id}
-                WITH e
-                OPTIONAL MATCH (e)-[r]-(:Department)
-                DELETE r
-                WITH e
-                MATCH (dd:Department {name: $department})
-                CREATE (e)-[rr:DIRECTS]->(dd)
-                WITH e, rr
-                SET rr.assigned = date($assigned)
-                WITH e
-                MATCH (p:Project {name: $projname})
-                CREATE (e)-[a:ASSIGNED_TO]->(p)
-                WITH e
-                RETURN e
-                '''
-            )
-        else:
-            query = (
-                '''
-                MATCH (e:Employee {id: $id})
-                SET e += {name: $name, surname: $surname, position: $position, skills: $skills, note: $note, id:$id}
-                WITH e
-                OPTIONAL MATCH (e)-[r]-(:Department)
-                DELETE r
-                WITH e
-                MATCH (dd:Department {name: $department})
-                CREATE (e)-[rr:WORKS_IN]->(dd)
-                WITH e, rr
-                SET rr.assigned = date($assigned)
-                WITH e
-                MATCH (p:Project {name: $projname})
-                CREATE (e)-[a:ASSIGNED_TO]->(p)
-                WITH e
-                RETURN e
-                '''
-            )
-        try:
-            result = tx.run(query,
-                            name=name, 
-                            surname=surname,
-                            position=position,
-                            department=department,
-                            skills=skills,
-                            note=note,
-                            id=id,
-                            assigned=assigned,
-                            projname=projname)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+    @instrumented(write=True)
+    def _edit_employee(self, tx, id: str, employee: dict):
+        '''
+        compares the form to the stored state in the same transaction and
+        touches only the changed properties and relationships; relationships
+        are merged, so saving twice doesn't add a second edge, and duplicates
+        left by older edits get dropped on the way
+        returns the names of the changed parts, None if nothing was written
+        because the employee, department or project does not exist
+        '''
+        props = {field: employee[field] for field in EDIT_FIELDS}
+        rel = 'DIRECTS' if employee['position'] == 'director' else 'WORKS_IN'
+        department = employee['department']
+        # the form shows N/A for an employee without a project
+        project = employee['project'] if employee['project'] not in (None, '', 'N/A') else None
+        state_query = (
+            '''
+            MATCH (e:Employee {id: $id})
+            OPTIONAL MATCH (e)-[r:WORKS_IN|DIRECTS]->(d:Department)
+            WITH e, collect([type(r), d.name]) AS depts
+            OPTIONAL MATCH (e)-[:ASSIGNED_TO]->(p:Project)
+            WITH e, depts, collect(p.name) AS projects
+            OPTIONAL MATCH (nd:Department {name: $department})
+            OPTIONAL MATCH (np:Project {name: $project})
+            RETURN e, depts, projects, nd IS NOT NULL AS department_exists, np IS NOT NULL AS project_exists
+            '''
+        )
+        props_query = (
+            '''
+            MATCH (e:Employee {id: $id})
+            SET e += $changed
+            '''
+        )
+        # rel is one of the two types above, never user input
+        dept_query = (
+            f'''
+            MATCH (e:Employee {{id: $id}})
+            OPTIONAL MATCH (e)-[r:WORKS_IN|DIRECTS]->(d:Department)
+            WITH e, d, type(r) AS rtype, collect(r) AS edges
+            FOREACH (x IN CASE WHEN d.name = $department AND rtype = $rel THEN tail(edges) ELSE edges END | DELETE x)
+            WITH DISTINCT e
+            MATCH (nd:Department {{name: $department}})
+            MERGE (e)-[r:{rel}]->(nd)
+            ON CREATE SET r.assigned = date($assigned)
+            '''
+        )
+        project_query = (
+            '''
+            MATCH (e:Employee {id: $id})
+            OPTIONAL MATCH (e)-[a:ASSIGNED_TO]->(p:Project)
+            WITH e, p, collect(a) AS edges
+            FOREACH (x IN CASE WHEN p.name = $project THEN tail(edges) ELSE edges END | DELETE x)
+            WITH DISTINCT e
+            WHERE $project IS NOT NULL
+            MATCH (np:Project {name: $project})
+            MERGE (e)-[:ASSIGNED_TO]->(np)
+            '''
+        )
+        state = tx.run(state_query, id=id, department=department, project=project).single()
+        if state is None:
+            logger.critical('Employee %s to edit not found', id)
+            return
+        if not state['department_exists'] or (project and not state['project_exists']):
+            logger.critical('Employee %s edit names an unknown department %s or project %s', id, department, project)
+            return
+
+        current = dict(state['e'])
+        changed = {field: value for field, value in props.items() if current.get(field) != value}
+        parts = list(changed)
+        if changed:
+            tx.run(props_query, id=id, changed=changed).consume()
+        if state['depts'] != [[rel, department]]:
+            tx.run(dept_query, id=id, department=department, rel=rel, assigned=self.get_date()).consume()
+            parts.append('department')
+        if state['projects'] != ([project] if project else []):
+            tx.run(project_query, id=id, project=project).consume()
+            parts.append('project')
+
+        return parts
 
 
     def get_employee(self, id: str):
-        '''returns employee details'''
-        with self.driver.session() as session:
+        '''
+        returns employee details
+        the query returns one row, department and projects are collected,
+        so the result grows with the employee's degree instead of multiplying
+        '''
+        with self.session() as session:
             r = session.read_transaction(
                 self._get_employee,
                 id
@@ -359,44 +930,64 @@ class Neo_client:
             if not r:
                 logger.critical('Employee overview lookup failed miserably OR no employees present..')
                 return 
-            logger.critical(r)
-            for row in r:
-                data = row.data()
-                employee = data['e']
-                department = data.get('d')
-                employee['department'] = department['name'] if department else 'N/A'
-                employee['assigned'] = data.get('assigned', 'N/A')
-                employee['project_id'] = data.get('pid', 'N/A')
-                employee['project'] = data.get('pname', 'N/A')
 
-            logger.critical(r)
-            logger.critical(employee)
+            data = r[0].data()
+            employee = data['e']
+            department = data.get('department') or {}
+            projects = list({p['id']: p for p in data['projects']}.values())
+            employee['department'] = department.get('name') or 'N/A'
+            employee['assigned'] = department.get('assigned') or 'N/A'
+            employee['project_id'] = projects[0]['id'] if projects else 'N/A'
+            employee['project'] = projects[0]['name'] if projects else 'N/A'
+            employee['projects'] = projects
+
+            logger.debug('Employee %s: %s', id, employee)
             return employee
 
 
+    @instrumented
     def _get_employee(self, tx, id: str):
         query = (
             '''
             MATCH (e:Employee {id: $id})
-            OPTIONAL MATCH (e)-[r]->(d:Department)
-            OPTIONAL MATCH (e)-[r]->(p:Project)
-            RETURN e, r.assigned AS assigned, d, p.id AS pid, p.name as pname
+            RETURN e,
+                head([(e)-[r:WORKS_IN|DIRECTS]->(d:Department) | {name: d.name, assigned: r.assigned}]) AS department,
+                [(e)-[:ASSIGNED_TO]->(p:Project) | p {.id, .name}] AS projects
             '''
         )
-        try:
-            result = tx.run(query, id=id)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, id=id)
+        return [record for record in result]
+
+
+    def get_employee_edit_page(self, id: str):
+        '''
+        everything the employee edit form needs: the employee as get_employee
+        returns it, in one statement, and the department and project choices
+        from the choices cache, the three loaded side by side
+        '''
+        employee, dept_choices, proj_choices = self.concurrently(
+            lambda: self.get_employee(id),
+            self.get_dept_choices,
+            self.get_project_choices,
+        )
+        if not employee or dept_choices is None or proj_choices is None:
+            logger.critical('Employee edit page lookup failed miserably.')
+            return
+
+        return {
+            'employee': employee,
+            'dept_choices': dept_choices,
+            'proj_choices': proj_choices,
+        }
 
 
     def delete_employee(self, id: str):
         '''
         employee deletion
         '''
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._delete_employee,
+                self._versioned, self._delete_employee,
                 id=id
             )
             if not r:
@@ -405,6 +996,7 @@ class Neo_client:
             return True
 
 
+    @instrumented(write=True)
     def _delete_employee(self, tx, id:str):
         query = (
             '''
@@ -414,21 +1006,36 @@ class Neo_client:
             DELETE e
             '''
         )
-        try:
-            result = tx.run(query, id=id)
-            return result
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, id=id)
+        deleted = result.consume().counters.nodes_deleted
+        if deleted:
+            self._increment_counter(tx, self.terminated_counter(), deleted)
+        return result
 
 
-    def get_all_employees(self):
-        ''' returns all employees and their data '''
+    def get_all_employees(self, after: str=None, limit: int=None):
+        '''
+        returns employees and their data ordered by surname and id
+        pass the cursor of the previous page as after and a page size as limit,
+        leave both out for the whole list
+        employees without a surname, which only imports leave behind, come
+        last, ordered by id; their cursors carry a null surname
+        '''
         employees = []
-        with self.driver.session() as session:
-            r = session.read_transaction(
-                self._get_all_employees
-            )
-            if not r:
+        after_surname, after_id = self.decode_cursor(after, 2)
+        with self.session() as session:
+            r = []
+            if after_surname is not None or after_id is None:
+                r = session.read_transaction(
+                    self._get_all_employees, after_surname or '', after_id or '', limit
+                )
+                after_id = ''
+            if r is not None and (limit is None or len(r) < limit):
+                rest = session.read_transaction(
+                    self._get_employees_without_surname, after_id, limit - len(r) if limit else None
+                )
+                r = r + rest if rest is not None else None
+            if r is None:
                 logger.critical('Employees overview lookup failed miserably.')
                 return "internal server error"
             for row in r:
@@ -444,69 +1051,203 @@ class Neo_client:
             return employees
 
 
-    def _get_all_employees(self, tx):
+    @instrumented
+    def _get_all_employees(self, tx, after_surname: str, after_id: str, limit: int):
+        # the range on surname lets the planner seek the surname index and
+        # read it in order, the second condition resolves surname ties by id
         query = (
-            "MATCH (e:Employee)"
-            "OPTIONAL MATCH (e)-->(d:Department)"
-            "OPTIONAL MATCH (e)-->(p:Project)"
-            "RETURN e, d, p"
+            f'''
+            MATCH (e:Employee)
+            WHERE e.surname >= $after_surname
+            AND (e.surname > $after_surname OR e.id > $after_id)
+            WITH e ORDER BY e.surname, e.id
+            {self._limit_clause(limit)}
+            RETURN e, head([(e)-->(d:Department) | d]) AS d, head([(e)-->(p:Project) | p]) AS p
+            ORDER BY e.surname, e.id
+            '''
         )
-        try:
-            result = tx.run(query)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, after_surname=after_surname, after_id=after_id, limit=limit)
+        return [record for record in result]
+
+
+    @instrumented
+    def _get_employees_without_surname(self, tx, after_id: str, limit: int):
+        # nulls are not in the surname index, these are walked by the id index
+        # instead, and only once the pages of surnames have run out
+        query = (
+            f'''
+            MATCH (e:Employee)
+            WHERE e.id > $after_id AND e.surname IS NULL
+            WITH e ORDER BY e.id
+            {self._limit_clause(limit)}
+            RETURN e, head([(e)-->(d:Department) | d]) AS d, head([(e)-->(p:Project) | p]) AS p
+            ORDER BY e.id
+            '''
+        )
+        result = tx.run(query, after_id=after_id, limit=limit)
+        return [record for record in result]
 
     
     def get_aggregates(self):
         ''' get aggregate stats for structure overview page '''
-        with self.driver.session() as session:
+        start, end = self.get_period('month')
+        # two independent reads, run side by side
+        r, rr = self.concurrently(
+            lambda: self._read(self._get_aggregates),
+            lambda: self._read(self._get_new_hires, start, end),
+        )
+        if not r or not rr:
+            logger.critical('Employees overview lookup failed miserably.')
+            return
+
+        data = r[0].data()
+        data['newbies'] = rr[0]['hires']
+
+        return data
+
+
+    @instrumented
+    def _get_aggregates(self, tx):
+        # each subquery is a bare label or type count, answered by the count store
+        query = (
+            '''
+            CALL { MATCH (e:Employee) RETURN count(e) AS emp }
+            CALL { MATCH (d:Department) RETURN count(d) AS dep }
+            CALL { MATCH ()-[r:DIRECTS]->() RETURN count(r) AS dir }
+            OPTIONAL MATCH (c:Counter {name: $terminated})
+            RETURN emp, dep, dir, coalesce(c.value, 0) AS terminated
+            '''
+        )
+        result = tx.run(query, terminated=self.terminated_counter())
+        return [record for record in result]
+
+    
+    def count_new_hires(self, start: str, end: str):
+        '''
+        number of employees who started between start (inclusive) and end (exclusive)
+        see get_period for month, quarter and year windows
+        '''
+        with self.session() as session:
             r = session.read_transaction(
-                self._get_aggregates
-            )
-            rr = session.read_transaction(
-                self._get_monthly_newbies
+                self._get_new_hires, start, end
             )
-            if not r or not rr:
-                logger.critical('Employees overview lookup failed miserably.')
+            if not r:
+                logger.critical('New hires lookup failed miserably.')
                 return
 
-            data = r[0].data()
-            data['newbies'] = rr[0].data().get('rr', 999)
-            data['terminated'] = 4 #TODO
-            
-            return data
+            return r[0]['hires']
 
 
-    def _get_aggregates(self, tx):
+    @instrumented
+    def _get_new_hires(self, tx, start: str, end: str):
+        # a range on the indexed date, no per-employee string handling
         query = (
             '''
-            MATCH (e:Employee), (d:Department), ()-[r:DIRECTS]-()
-            RETURN count(DISTINCT e) as emp, count(DISTINCT d) as dep, count(DISTINCT r) as dir
+            MATCH (e:Employee)
+            WHERE e.started >= date($start) AND e.started < date($end)
+            RETURN count(e) AS hires
             '''
         )
-        try:
-            result = tx.run(query)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, start=start, end=end)
+        return [record for record in result]
 
-    
-    def _get_monthly_newbies(self, tx):
-        month = self.get_date(month=True)
+
+    def migrate_started_dates(self, batch_size: int=1000) -> int:
+        '''
+        converts employee start dates stored as 'YYYY-MM-DD' strings to native dates
+        walks the employees by id in batches, each batch its own transaction,
+        so it can be interrupted and rerun; returns the number converted
+        '''
+        after_id = ''
+        converted = 0
+        while True:
+            with self.session(WRITE_ACCESS) as session:
+                r = session.write_transaction(
+                    self._versioned, self._migrate_started_batch, after_id, batch_size
+                )
+            if not r:
+                logger.critical('Start date migration failed miserably after id %s.', after_id)
+                return converted
+
+            batch = r[0]
+            if not batch['scanned']:
+                break
+            converted += batch['converted']
+            after_id = batch['last_id']
+            logger.info('Start dates converted: %s, last id: %s', converted, after_id)
+
+        return converted
+
+
+    @instrumented(write=True)
+    def _migrate_started_batch(self, tx, after_id: str, batch_size: int):
         query = (
             '''
             MATCH (e:Employee)
-            WITH  split(e.started,'-')[1] AS m, e
-            WHERE m = $month
-            return count(e) as rr
+            WHERE e.id > $after_id
+            WITH e ORDER BY e.id
+            LIMIT $batch_size
+            WITH collect(e) AS batch
+            WITH batch, [x IN batch WHERE toString(x.started) = x.started
+                         AND x.started =~ '[0-9]{4}-[0-9]{2}-[0-9]{2}'] AS todo
+            FOREACH (x IN todo | SET x.started = date(x.started))
+            RETURN size(batch) AS scanned, size(todo) AS converted, batch[-1].id AS last_id
             '''
         )
-        try:
-            result = tx.run(query, month=month)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, after_id=after_id, batch_size=batch_size)
+        return [record for record in result]
+
+    def compact_relationships(self, batch_size: int=1000) -> int:
+        '''
+        deletes duplicate relationships, keeping one edge of each type between
+        two nodes; walks the start nodes by their unique key in batches,
+        each batch its own transaction, so it can be interrupted and rerun
+        returns the number of deleted edges
+        '''
+        deleted = 0
+        for label, (key, types) in COMPACT_RELATIONSHIPS.items():
+            after = ''
+            while True:
+                with self.session(WRITE_ACCESS) as session:
+                    r = session.write_transaction(
+                        self._versioned, self._compact_batch, label, key, types, after, batch_size
+                    )
+                if not r:
+                    logger.critical('Relationship compaction failed miserably after %s %s.', label, after)
+                    return deleted
+
+                batch = r[0]
+                if not batch['scanned']:
+                    break
+                deleted += batch['deleted']
+                after = batch['last']
+                logger.info('Duplicate relationships deleted: %s, last %s: %s', deleted, label, after)
+
+        return deleted
+
+
+    @instrumented(write=True)
+    def _compact_batch(self, tx, label: str, key: str, types: list, after: str, batch_size: int):
+        # label, key and types come from COMPACT_RELATIONSHIPS, never from user input
+        query = (
+            f'''
+            MATCH (a:{label})
+            WHERE a.{key} > $after
+            WITH a ORDER BY a.{key}
+            LIMIT $batch_size
+            CALL {{
+                WITH a
+                MATCH (a)-[r:{'|'.join(types)}]->(b)
+                WITH b, type(r) AS rtype, collect(r) AS edges
+                WHERE size(edges) > 1
+                FOREACH (x IN tail(edges) | DELETE x)
+                RETURN sum(size(edges) - 1) AS deleted
+            }}
+            RETURN count(a) AS scanned, sum(deleted) AS deleted, max(a.{key}) AS last
+            '''
+        )
+        result = tx.run(query, after=after, batch_size=batch_size)
+        return [record for record in result]
 
 ### PROJECTS
 
@@ -516,9 +1257,9 @@ class Neo_client:
             client = proj.get('client')
             description = proj.get('description')
             dept = proj.get('department')
-            with self.driver.session() as session:
+            with self.session(WRITE_ACCESS) as session:
                 r = session.write_transaction(
-                    self._create_project, name, client, description, dept
+                    self._versioned, self._create_project, name, client, description, dept
                 )
                 if not r:
                     logger.critical('Project creation failed miserably.')
@@ -527,8 +1268,9 @@ class Neo_client:
             return True
 
         
+    @instrumented(write=True)
     def _create_project(self, tx, name: str, client: str, description: str, dept: str):
-        id = self.new_id(4)
+        id = self.new_id()
         since = self.get_date()
         query = (
             '''
@@ -540,24 +1282,26 @@ class Neo_client:
             RETURN p
             '''
         )
-        try:
-            result = tx.run(query, name=name, id=id, description=description, client=client, dept=dept, since=since)
-            logger.info('Created project %s, id: %s', name, id)
-            return result
+        result = tx.run(query, name=name, id=id, description=description, client=client, dept=dept, since=since)
+        logger.info('Created project %s, id: %s', name, id)
+        return result
 
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
 
     
-    def get_all_projects(self):
-        ''' get a list of all departments '''
+    def get_all_projects(self, after: str=None, limit: int=None):
+        '''
+        get a list of projects ordered by id
+        pass the cursor of the previous page as after and a page size as limit,
+        leave both out for the whole list
+        '''
 
         projects = []
-        with self.driver.session() as session:
+        after_id, = self.decode_cursor(after, 1)
+        with self.session() as session:
             r = session.read_transaction(
-                self._get_all_projects
+                self._get_all_projects, after_id, limit
             )
-            if not r:
+            if r is None:
                 logger.critical('Projects overview lookup failed miserably.')
                 return 
             for row in r:
@@ -569,26 +1313,91 @@ class Neo_client:
             
             return projects
 
-    def _get_all_projects(self, tx):
+    @instrumented
+    def _get_all_projects(self, tx, after_id: str, limit: int):
+        where = 'WHERE p.id > $after_id' if after_id is not None else ''
         query = (
-            "MATCH (p:Project)"
-            "OPTIONAL MATCH (p:Project)<-[:OWNS]-(d:Department)"
-            "RETURN p, d"
+            f'''
+            MATCH (p:Project)
+            {where}
+            WITH p ORDER BY p.id
+            {self._limit_clause(limit)}
+            OPTIONAL MATCH (p)<-[:OWNS]-(d:Department)
+            WITH p, head(collect(d)) AS d
+            RETURN p, d
+            ORDER BY p.id
+            '''
         )
-        try:
-            result = tx.run(query)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, after_id=after_id, limit=limit)
+        return [record for record in result]
+
+
+    def get_project_choices(self) -> list:
+        ''' project names for form choices, cached '''
+        return self._cached_choices('projects', self._load_project_choices)
+
+
+    def _load_project_choices(self):
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_names, 'Project'
+            )
+            if r is None:
+                logger.critical('Project choices lookup failed miserably.')
+                return
+
+            return [row['name'] for row in r]
+
+
+    def get_project_page(self, id: str):
+        '''
+        project detail page in one statement:
+        the project with its owning department and all assigned employees
+        '''
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_project_page,
+                id
+            )
+            if not r:
+                logger.critical('Project page lookup failed miserably.')
+                return
+
+            data = r[0].data()
+            project = data['p']
+            project['department'] = data.get('department') or 'N/A'
+            project['since'] = data.get('since') or 'N/A'
+            project['employees'] = data['employees']
+
+            return project
+
+
+    @instrumented
+    def _get_project_page(self, tx, id: str):
+        query = (
+            '''
+            MATCH (p:Project {id: $id})
+            WITH p, head([(p)<-[r:OWNS]-(d:Department) | [d.name, r.since]]) AS owner
+            CALL {
+                WITH p
+                MATCH (p)<-[:ASSIGNED_TO]-(e:Employee)
+                WITH DISTINCT e ORDER BY e.surname, e.id
+                RETURN collect(e) AS employees
+            }
+            RETURN p, owner[0] AS department, owner[1] AS since, employees
+            '''
+        )
+        result = tx.run(query, id=id)
+        return [record for record in result]
 
 
     def delete_project(self, id: str):
         '''
         project deletion
         '''
-        with self.driver.session() as session:
+        with self.session(WRITE_ACCESS) as session:
             r = session.write_transaction(
-                self._delete_project,
+                self._versioned, self._delete_project,
                 id=id
             )
             if not r:
@@ -597,6 +1406,7 @@ class Neo_client:
             return True
 
 
+    @instrumented(write=True)
     def _delete_project(self, tx, id:str):
         query = (
             '''
@@ -606,48 +1416,189 @@ class Neo_client:
             DELETE p
             '''
         )
-        try:
-            result = tx.run(query, id=id)
-            return result
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
+        result = tx.run(query, id=id)
+        return result
 
 
-    def get_project(self, id: str):
-            '''returns project details'''
-            with self.driver.session() as session:
-                r = session.read_transaction(
-                    self._get_project,
-                    id
-                )
-                if not r:
-                    logger.critical('Project overview lookup failed miserably OR no projects present..')
-                    return 
-                logger.critical(r)
-                for row in r:
-                    data = row.data()
-                    project = data['p']
-                    department = data.get('d')
-                    employees = data.get('e')
-                    project['department'] = department['name'] if department else 'N/A'
-                    project['since'] = data.get('since', 'N/A')
-                    project['employees'] = employees
-
-                logger.critical(project)
-                return project
-
-
-    def _get_project(self, tx, id: str):
+### SEARCH
+
+    @staticmethod
+    def lucene_query(text: str, prefix: bool=False) -> str:
+        '''
+        a Lucene query matching all words of text, Lucene syntax in it is ignored
+        words also match as prefixes, whole word matches rank higher;
+        with prefix=True only the prefixes count, for typeahead
+        '''
+        terms = SEARCH_WORD.findall(text.lower())
+        if prefix:
+            return ' AND '.join(f'{term}*' for term in terms)
+
+        return ' AND '.join(f'({term} OR {term}*)' for term in terms)
+
+
+    def search(self, text: str, limit: int=25, prefix: bool=False):
+        '''
+        ranked fulltext matches among employees, departments and projects
+        rows are dicts with kind, id, label, detail and score, best first
+        '''
+        query = self.lucene_query(text, prefix)
+        if not query:
+            return []
+
+        with self.session() as session:
+            r = session.read_transaction(
+                self._get_search_results, query, limit
+            )
+            if r is None:
+                logger.critical('Search failed miserably.')
+                return
+
+            return [row.data() for row in r]
+
+
+    @instrumented
+    def _get_search_results(self, tx, query: str, limit: int):
+        result = tx.run(SEARCH_QUERY, query=query, limit=limit)
+        return [record for record in result]
+
+
+### EXPORT
+
+    def stream_export(self, kind: str):
+        '''
+        yields the rows of an export (see EXPORTS) as dicts, one at a time
+        the records are read off the result cursor in fetch_size chunks,
+        so memory use does not grow with the size of the export;
+        the session stays open until the generator is exhausted or closed
+        '''
+        columns, query = EXPORTS[kind]
+        with self.session(fetch_size=EXPORT_FETCH_SIZE) as session:
+            try:
+                result = session.run(query)
+                for record in result:
+                    yield dict(zip(columns, record.values(*columns)))
+            except Exception as e:
+                logger.critical('Export of %s failed; %s, exception: %s', kind, type(self).__name__, e)
+                raise
+
+### BULK IMPORT
+
+    def import_depts(self, rows: list):
+        '''
+        creates a batch of departments in one transaction
+        rows are dicts with name and description, existing names are updated
+        returns the number of rows written
+        '''
+        for row, id in zip(rows, self.id_allocator.new_ids(len(rows))):
+            row['id'] = row.get('id') or id
+        with self.session(WRITE_ACCESS) as session:
+            r = session.write_transaction(
+                self._versioned, self._import_depts, rows
+            )
+            if r is None:
+                logger.critical('Department import failed miserably.')
+                return
+
+            return r[0]['written']
+
+
+    @instrumented(write=True)
+    def _import_depts(self, tx, rows: list):
         query = (
             '''
-            MATCH (p:Project {id: $id})
-            OPTIONAL MATCH (p:Project {id: $id})<-[r:OWNS]-(d:Department)
-            OPTIONAL MATCH (p:Project {id: $id})<-[:ASSIGNED_TO]-(e:Employee)
-            return p, d, e, r.since AS since
+            UNWIND $rows AS row
+            MERGE (d:Department {name: row.name})
+            ON CREATE SET d.id = row.id
+            SET d.description = row.description
+            RETURN count(d) AS written
             '''
         )
-        try:
-            result = tx.run(query, id=id)
-            return [record for record in result]
-        except Exception as e:
-            logger.critical('Failed to execute a query; %s, exception: %s', type(self).__name__, e)
\ No newline at end of file
+        result = tx.run(query, rows=rows)
+        return [record for record in result]
+
+
+    def import_employees(self, rows: list):
+        '''
+        creates a batch of employees in one transaction
+        rows are dicts with the employee form fields, department and project
+        are resolved by name in the same statement; rows naming an unknown
+        department are skipped, rows carrying an id update that employee
+        returns the number of rows written
+        '''
+        today = self.get_date()
+        for row, id in zip(rows, self.id_allocator.new_ids(len(rows))):
+            row['id'] = row.get('id') or id
+            row['started'] = row.get('started') or today
+        with self.session(WRITE_ACCESS) as session:
+            r = session.write_transaction(
+                self._versioned, self._import_employees, rows
+            )
+            if r is None:
+                logger.critical('Employee import failed miserably.')
+                return
+
+            return r[0]['written']
+
+
+    @instrumented(write=True)
+    def _import_employees(self, tx, rows: list):
+        query = (
+            '''
+            UNWIND $rows AS row
+            MATCH (d:Department {name: row.department})
+            MERGE (e:Employee {id: row.id})
+            SET e += {name: row.name, surname: row.surname, position: row.position,
+                      skills: row.skills, note: row.note, started: date(row.started)}
+            FOREACH (_ IN CASE WHEN row.position = 'director' THEN [1] ELSE [] END |
+                MERGE (e)-[r:DIRECTS]->(d) ON CREATE SET r.assigned = date(row.started))
+            FOREACH (_ IN CASE WHEN row.position <> 'director' THEN [1] ELSE [] END |
+                MERGE (e)-[r:WORKS_IN]->(d) ON CREATE SET r.assigned = date(row.started))
+            WITH e, row
+            OPTIONAL MATCH (p:Project {name: row.project})
+            WITH e, head(collect(p)) AS p
+            FOREACH (_ IN CASE WHEN p IS NULL THEN [] ELSE [1] END |
+                MERGE (e)-[:ASSIGNED_TO]->(p))
+            RETURN count(e) AS written
+            '''
+        )
+        result = tx.run(query, rows=rows)
+        return [record for record in result]
+
+
+    def import_projects(self, rows: list):
+        '''
+        creates a batch of projects in one transaction
+        rows are dicts with the project form fields, the owning department
+        is resolved by name and rows naming an unknown one are skipped
+        returns the number of rows written
+        '''
+        since = self.get_date()
+        for row, id in zip(rows, self.id_allocator.new_ids(len(rows))):
+            row['id'] = row.get('id') or id
+            row['since'] = row.get('since') or since
+        with self.session(WRITE_ACCESS) as session:
+            r = session.write_transaction(
+                self._versioned, self._import_projects, rows
+            )
+            if r is None:
+                logger.critical('Project import failed miserably.')
+                return
+
+            return r[0]['written']
+
+
+    @instrumented(write=True)
+    def _import_projects(self, tx, rows: list):
+        query = (
+            '''
+            UNWIND $rows AS row
+            MATCH (d:Department {name: row.department})
+            MERGE (p:Project {id: row.id})
+            SET p += {name: row.name, client: row.client, description: row.description}
+            MERGE (p)<-[o:OWNS]-(d)
+            ON CREATE SET o.since = row.since
+            RETURN count(p) AS written
+            '''
+        )
+        result = tx.run(query, rows=rows)
+        return [record for record in result]
@@ -0,0 +1,70 @@
+''' connection pool telemetry for the neo4j driver '''
+
+import time
+from functools import wraps
+from threading import Lock
+from graphr.logger import logger
+
+
+class PoolMetrics:
+    '''
+    live numbers of the driver connection pool
+    the driver has no public pool API, so this wraps the pool's connection
+    acquisition to time it and count failures, and reads the pooled
+    connections for the in-use and idle gauges; if the driver internals
+    change the gauges report None instead of breaking the app
+    '''
+    def __init__(self, driver):
+        self.acquisitions = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = Lock()
+        self._pool = getattr(driver, '_pool', None)
+        acquire = getattr(self._pool, '_acquire', None)
+        if acquire is None:
+            logger.warning('Connection pool internals not found, pool metrics disabled')
+            return
+        self._pool._acquire = self._timed(acquire)
+
+    def _timed(self, acquire):
+        @wraps(acquire)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return acquire(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                raise
+            finally:
+                waited = time.perf_counter() - start
+                with self._lock:
+                    self.acquisitions += 1
+                    self.wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+        return wrapper
+
+    def _connections(self) -> list:
+        connections = getattr(self._pool, 'connections', None)
+        if connections is None:
+            return None
+        # snapshot, the pool mutates the deques from other greenlets
+        return [connection for address in list(connections) for connection in list(connections[address])]
+
+    def info(self) -> dict:
+        ''' in-use and idle connections, acquisition count, wait times and failures '''
+        connections = self._connections()
+        in_use = sum(1 for c in connections if getattr(c, 'in_use', False)) if connections is not None else None
+        config = getattr(self._pool, 'pool_config', None)
+        with self._lock:
+            return {
+                'max_size': getattr(config, 'max_connection_pool_size', None),
+                'in_use': in_use,
+                'idle': len(connections) - in_use if connections is not None else None,
+                'acquisitions': self.acquisitions,
+                'acquisition_failures': self.failures,
+                'acquisition_wait_seconds_total': round(self.wait_seconds, 6),
+                'acquisition_wait_seconds_max': round(self.max_wait_seconds, 6),
+            }
@@ -0,0 +1,143 @@
+''' slow query log and sampled query plan capture '''
+
+import logging
+import random
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from graphr.logger import logger
+
+PROFILE_LOG_MAX_BYTES = 5 * 1024 * 1024
+PROFILE_LOG_BACKUPS = 5
+# a query is re-run for its plan at most once per this many seconds,
+# so a query that is always slow doesn't get its load doubled
+PROFILE_CAPTURE_INTERVAL = 300
+# parameters are logged shortened, an import batch is not worth a log line
+PARAMETER_MAX_ITEMS = 5
+PARAMETER_MAX_CHARS = 80
+# operators that usually mean a missing index or a badly written pattern
+SUSPECT_OPERATORS = ('AllNodesScan', 'NodeByLabelScan', 'CartesianProduct', 'Eager')
+
+
+class RecordingTransaction:
+    ''' transaction proxy that remembers the queries run through it and their results '''
+    def __init__(self, tx):
+        self._tx = tx
+        self.queries = []
+        self.results = []
+
+    def run(self, query, parameters=None, **kwparameters):
+        self.queries.append((query, {**(parameters or {}), **kwparameters}))
+        result = self._tx.run(query, parameters, **kwparameters)
+        self.results.append(result)
+        return result
+
+    def contains_updates(self) -> bool:
+        ''' whether any of the queries changed the graph, consumes what is left of their results '''
+        return any(result.consume().counters.contains_updates for result in self.results)
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+
+def describe_parameters(value):
+    ''' query parameters shortened for the logs, long lists and strings are cut '''
+    if isinstance(value, dict):
+        return {key: describe_parameters(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > PARAMETER_MAX_ITEMS:
+            return f'<{len(value)} items>'
+        return [describe_parameters(item) for item in value]
+    if isinstance(value, str) and len(value) > PARAMETER_MAX_CHARS:
+        return value[:PARAMETER_MAX_CHARS] + '...'
+
+    return value
+
+
+def format_plan(plan: dict, depth: int=0) -> list:
+    ''' operator tree of a PROFILE/EXPLAIN summary as indented lines '''
+    stats = ' '.join(f'{key}={plan[key]}' for key in ('rows', 'dbHits') if key in plan)
+    details = plan.get('args', {}).get('Details', '')
+    lines = ['  ' * depth + f"{plan.get('operatorType')} {stats} {details}".rstrip()]
+    for child in plan.get('children', []):
+        lines.extend(format_plan(child, depth + 1))
+
+    return lines
+
+
+def plan_operators(plan: dict) -> list:
+    ''' all operator names in a plan tree '''
+    operators = [plan.get('operatorType', '').split('@')[0]]
+    for child in plan.get('children', []):
+        operators.extend(plan_operators(child))
+
+    return operators
+
+
+class QueryProfiler:
+    '''
+    logs transaction functions slower than slow_ms with their parameters,
+    and, when given a log file, captures the plan of slow ones plus a sample_rate
+    fraction of all into it; reads are re-run under PROFILE for db hits and rows,
+    writes only under EXPLAIN so nothing gets written twice
+    the capture runs in the background, off the request, and at most once
+    per PROFILE_CAPTURE_INTERVAL for each transaction function
+    '''
+    def __init__(self, driver, slow_ms: float=500, sample_rate: float=0.0, log_path: str=None):
+        self.driver = driver
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.plan_logger = None
+        self._captured = {}
+        self._lock = threading.Lock()
+        if log_path:
+            self.plan_logger = logging.getLogger('graphr.profile')
+            self.plan_logger.propagate = False
+            self.plan_logger.setLevel(logging.INFO)
+            if not self.plan_logger.handlers:
+                handler = RotatingFileHandler(log_path, maxBytes=PROFILE_LOG_MAX_BYTES,
+                                              backupCount=PROFILE_LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                self.plan_logger.addHandler(handler)
+
+    def observe(self, name: str, seconds: float, queries: list, write: bool):
+        ''' called after every transaction function with the queries it ran '''
+        elapsed_ms = seconds * 1000
+        slow = self.slow_ms is not None and elapsed_ms >= self.slow_ms
+        if slow:
+            # the time is the whole transaction's, so one line for all its statements
+            logger.warning('Slow query %s took %.0f ms, %s statements, parameters: %s',
+                           name, elapsed_ms, len(queries),
+                           [describe_parameters(parameters) for _, parameters in queries])
+        if self.plan_logger and queries and (slow or random.random() < self.sample_rate) and self._due(name):
+            threading.Thread(target=self.capture, args=(name, elapsed_ms, queries, write), daemon=True).start()
+
+    def _due(self, name: str) -> bool:
+        ''' whether the plan of name may be captured now, marks it captured if so '''
+        now = time.monotonic()
+        with self._lock:
+            if now - self._captured.get(name, -PROFILE_CAPTURE_INTERVAL) < PROFILE_CAPTURE_INTERVAL:
+                return False
+            self._captured[name] = now
+
+        return True
+
+    def capture(self, name: str, elapsed_ms: float, queries: list, write: bool):
+        ''' re-runs the queries under PROFILE or EXPLAIN and writes the plans '''
+        mode = 'EXPLAIN' if write else 'PROFILE'
+        try:
+            with self.driver.session() as session:
+                for query, parameters in queries:
+                    summary = session.run(f'{mode} {query}', parameters).consume()
+                    plan = summary.profile if mode == 'PROFILE' else summary.plan
+                    if not plan:
+                        continue
+                    suspects = sorted(set(plan_operators(plan)) & set(SUSPECT_OPERATORS))
+                    lines = [f'{mode} {name} ({elapsed_ms:.0f} ms) parameters: {describe_parameters(parameters)}',
+                             query.strip()] + format_plan(plan)
+                    if suspects:
+                        lines.append('suspect operators: ' + ', '.join(suspects))
+                        logger.warning('Query %s plan uses %s', name, ', '.join(suspects))
+                    self.plan_logger.info('\n'.join(lines) + '\n')
+        except Exception as e:
+            logger.debug('Plan capture of %s failed, exception: %s', name, e)
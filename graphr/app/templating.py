@@ -0,0 +1,34 @@
+''' production template mode and the page fragment cache '''
+
+import time
+from jinja2 import FileSystemBytecodeCache
+from graphr.logger import logger
+from .cache import TTLCache
+
+FRAGMENT_CACHE_SIZE = 256
+# fragment keys carry the graph version, the TTL only frees entries nobody asks for
+FRAGMENT_CACHE_TTL = 600
+
+
+def configure_templates(app, production: bool, cache_dir: str=None):
+    '''
+    development keeps reloading templates on change
+    production turns the reload checks off, keeps compiled templates in a
+    filesystem bytecode cache, so a restarted worker skips the Jinja compiler,
+    compiles every template up front and returns the fragment cache
+    '''
+    if not production:
+        app.config['TEMPLATES_AUTO_RELOAD'] = True
+        app.jinja_env.auto_reload = True
+        return
+
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_env.auto_reload = False
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir or None)
+    start = time.perf_counter()
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    logger.info('Compiled %s templates in %.3fs', len(names), time.perf_counter() - start)
+
+    return TTLCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL)
@@ -8,8 +8,29 @@ from graphr.version import __version__
 LOG_LEVEL_STRINGS = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG']
 LOG_LEVEL_DEFAULT = 'DEBUG'
 LOG_VERBOSE_DEFAULT = False
+LOG_FORMAT_STRINGS = ['json', 'text']
+LOG_FORMAT_DEFAULT = 'json'
+LOG_SAMPLE_RATE_DEFAULT = 1.0
 APP_LISTEN_ADDR_DEFAULT = '0.0.0.0'
 APP_PORT_DEFAULT = 4242
+NEO_MAX_POOL_SIZE_DEFAULT = 100
+NEO_ACQUISITION_TIMEOUT_DEFAULT = 60.0
+NEO_MAX_LIFETIME_DEFAULT = 3600
+NEO_KEEP_ALIVE_DEFAULT = True
+NEO_FETCH_SIZE_DEFAULT = 1000
+SLOW_QUERY_MS_DEFAULT = 500.0
+PROFILE_SAMPLE_RATE_DEFAULT = 0.0
+PROFILE_LOG_DEFAULT = ''
+PRODUCTION_DEFAULT = False
+WORKERS_DEFAULT = 1
+WORKER_CONNECTIONS_DEFAULT = 1000
+GRACEFUL_TIMEOUT_DEFAULT = 30.0
+TEMPLATE_CACHE_DIR_DEFAULT = ''
+MIGRATE_BATCH_SIZE_DEFAULT = 1000
+IMPORT_BATCH_SIZE_DEFAULT = 500
+COMPACT_BATCH_SIZE_DEFAULT = 1000
+IMPORT_KINDS = ['departments', 'employees', 'projects']
+IMPORT_FORMATS = ['csv', 'jsonl']
 
 def log_level_string_to_int(arg_string: str) -> int:
     '''get log level int from string'''
@@ -27,10 +48,11 @@ def log_level_string_to_int(arg_string: str) -> int:
     return log_level_int
 
 
-def get_pars():
+def get_pars(args: list=None):
     '''
     get parameters from from command line arguments
     defaults overriden by ENVs
+    args default to sys.argv, parsed when called, never on import
     '''
 
     env_vars = {
@@ -40,6 +62,12 @@ def get_pars():
         'LOG_VERBOSE': {
             'default': LOG_VERBOSE_DEFAULT
         },
+        'LOG_FORMAT': {
+            'default': LOG_FORMAT_DEFAULT
+        },
+        'LOG_SAMPLE_RATE': {
+            'default': LOG_SAMPLE_RATE_DEFAULT
+        },
         'NEO_LOGIN': {
             'required': True
         },
@@ -55,6 +83,45 @@ def get_pars():
         'APP_LISTEN_ADDR': {
             'default': APP_LISTEN_ADDR_DEFAULT
         },
+        'NEO_MAX_POOL_SIZE': {
+            'default': NEO_MAX_POOL_SIZE_DEFAULT
+        },
+        'NEO_ACQUISITION_TIMEOUT': {
+            'default': NEO_ACQUISITION_TIMEOUT_DEFAULT
+        },
+        'NEO_MAX_LIFETIME': {
+            'default': NEO_MAX_LIFETIME_DEFAULT
+        },
+        'NEO_KEEP_ALIVE': {
+            'default': NEO_KEEP_ALIVE_DEFAULT
+        },
+        'NEO_FETCH_SIZE': {
+            'default': NEO_FETCH_SIZE_DEFAULT
+        },
+        'SLOW_QUERY_MS': {
+            'default': SLOW_QUERY_MS_DEFAULT
+        },
+        'PROFILE_SAMPLE_RATE': {
+            'default': PROFILE_SAMPLE_RATE_DEFAULT
+        },
+        'PROFILE_LOG': {
+            'default': PROFILE_LOG_DEFAULT
+        },
+        'PRODUCTION': {
+            'default': PRODUCTION_DEFAULT
+        },
+        'TEMPLATE_CACHE_DIR': {
+            'default': TEMPLATE_CACHE_DIR_DEFAULT
+        },
+        'WORKERS': {
+            'default': WORKERS_DEFAULT
+        },
+        'WORKER_CONNECTIONS': {
+            'default': WORKER_CONNECTIONS_DEFAULT
+        },
+        'GRACEFUL_TIMEOUT': {
+            'default': GRACEFUL_TIMEOUT_DEFAULT
+        },
     }
 
     for env_var, env_pars in env_vars.items():
@@ -62,9 +129,11 @@ def get_pars():
             default = os.environ[env_var]
             if 'default' in env_pars:
                 if isinstance(env_pars['default'], bool):
-                    default = bool(os.environ[env_var])
-                elif isinstance(env_pars['default', int]):
+                    default = os.environ[env_var].lower() in ('1', 'true', 'yes', 'on')
+                elif isinstance(env_pars['default'], int):
                     default = int(os.environ[env_var])
+                elif isinstance(env_pars['default'], float):
+                    default = float(os.environ[env_var])
             env_pars['default'] = default
             env_pars['required'] = False
     
@@ -80,6 +149,22 @@ def get_pars():
                         type=log_level_string_to_int,
                         **env_vars['LOG_LEVEL'])
     
+    Parser.add_argument('--log-format',
+                        action='store',
+                        dest='log_format',
+                        help=(f"log record format {LOG_FORMAT_STRINGS} "
+                              f"(default {LOG_FORMAT_DEFAULT})"),
+                        choices=LOG_FORMAT_STRINGS,
+                        **env_vars['LOG_FORMAT'])
+
+    Parser.add_argument('--log-sample-rate',
+                        action='store',
+                        dest='log_sample_rate',
+                        help=('fraction of DEBUG records kept, for high volume debugging under load '
+                              f'(default {LOG_SAMPLE_RATE_DEFAULT})'),
+                        type=float,
+                        **env_vars['LOG_SAMPLE_RATE'])
+
     Parser.add_argument('-a',
                         '--app-listen-address',
                         action='store',
@@ -127,6 +212,174 @@ def get_pars():
                         help='neo4j database connection URI',
                         **env_vars['NEO_URI'])
 
-    return Parser.parse_args()
+    Parser.add_argument('--neo-max-pool-size',
+                        action='store',
+                        dest='neo_max_pool_size',
+                        help=('max connections kept per database server, '
+                              'size it to the number of concurrent greenlets '
+                              f'(default {NEO_MAX_POOL_SIZE_DEFAULT})'),
+                        type=int,
+                        **env_vars['NEO_MAX_POOL_SIZE'])
+
+    Parser.add_argument('--neo-acquisition-timeout',
+                        action='store',
+                        dest='neo_acquisition_timeout',
+                        help=('seconds to wait for a free pooled connection '
+                              f'(default {NEO_ACQUISITION_TIMEOUT_DEFAULT})'),
+                        type=float,
+                        **env_vars['NEO_ACQUISITION_TIMEOUT'])
+
+    Parser.add_argument('--neo-max-lifetime',
+                        action='store',
+                        dest='neo_max_lifetime',
+                        help=('seconds before a pooled connection is retired, '
+                              'keep it below the server idle timeout '
+                              f'(default {NEO_MAX_LIFETIME_DEFAULT})'),
+                        type=int,
+                        **env_vars['NEO_MAX_LIFETIME'])
+
+    Parser.add_argument('--neo-no-keep-alive',
+                        action='store_false',
+                        dest='neo_keep_alive',
+                        help='disable TCP keepalive on database connections',
+                        **env_vars['NEO_KEEP_ALIVE'])
+
+    Parser.add_argument('--neo-fetch-size',
+                        action='store',
+                        dest='neo_fetch_size',
+                        help=('records pulled per round trip while reading a result '
+                              f'(default {NEO_FETCH_SIZE_DEFAULT})'),
+                        type=int,
+                        **env_vars['NEO_FETCH_SIZE'])
+
+    Parser.add_argument('--slow-query-ms',
+                        action='store',
+                        dest='slow_query_ms',
+                        help=('log transactions slower than this, with their parameters '
+                              f'(default {SLOW_QUERY_MS_DEFAULT})'),
+                        type=float,
+                        **env_vars['SLOW_QUERY_MS'])
+
+    Parser.add_argument('--profile-sample-rate',
+                        action='store',
+                        dest='profile_sample_rate',
+                        help=('fraction of queries whose plan is captured besides the slow ones, 0-1 '
+                              f'(default {PROFILE_SAMPLE_RATE_DEFAULT})'),
+                        type=float,
+                        **env_vars['PROFILE_SAMPLE_RATE'])
+
+    Parser.add_argument('--profile-log',
+                        action='store',
+                        dest='profile_log',
+                        help=('rotating file for captured query plans, capture is off '
+                              'unless one is given (default off)'),
+                        type=str,
+                        **env_vars['PROFILE_LOG'])
+
+    Parser.add_argument('--production',
+                        action='store_true',
+                        dest='production',
+                        help=('production mode: no template reload checks, templates precompiled '
+                              'into a bytecode cache, list tables cached by graph version'),
+                        **env_vars['PRODUCTION'])
+
+    Parser.add_argument('--template-cache-dir',
+                        action='store',
+                        dest='template_cache_dir',
+                        help=('directory of the template bytecode cache in production mode '
+                              '(default a directory in the system temp dir)'),
+                        type=str,
+                        **env_vars['TEMPLATE_CACHE_DIR'])
+
+    Parser.add_argument('-w',
+                        '--workers',
+                        action='store',
+                        dest='workers',
+                        help=('server processes forked on a shared listening socket, '
+                              '0 for one per CPU; SIGHUP to the master restarts them one by one '
+                              f'(default {WORKERS_DEFAULT})'),
+                        type=int,
+                        **env_vars['WORKERS'])
+
+    Parser.add_argument('--worker-connections',
+                        action='store',
+                        dest='worker_connections',
+                        help=('requests a server process handles concurrently, '
+                              'the next ones wait in the listen backlog '
+                              f'(default {WORKER_CONNECTIONS_DEFAULT})'),
+                        type=int,
+                        **env_vars['WORKER_CONNECTIONS'])
+
+    Parser.add_argument('--graceful-timeout',
+                        action='store',
+                        dest='graceful_timeout',
+                        help=('seconds a stopping server process gets to finish its requests '
+                              f'(default {GRACEFUL_TIMEOUT_DEFAULT})'),
+                        type=float,
+                        **env_vars['GRACEFUL_TIMEOUT'])
+
+    Commands = Parser.add_subparsers(dest='command',
+                                     metavar='command',
+                                     help='maintenance command to run instead of the web server')
+
+    Migrate = Commands.add_parser('migrate-dates',
+                                  help='convert employee start dates stored as strings to native dates')
+
+    Migrate.add_argument('-b',
+                         '--batch-size',
+                         action='store',
+                         dest='batch_size',
+                         help=('employees per transaction '
+                               f'(default {MIGRATE_BATCH_SIZE_DEFAULT})'),
+                         type=int,
+                         default=MIGRATE_BATCH_SIZE_DEFAULT)
+
+    Compact = Commands.add_parser('compact',
+                                  help='delete duplicate relationships left behind by older employee edits')
+
+    Compact.add_argument('-b',
+                         '--batch-size',
+                         action='store',
+                         dest='batch_size',
+                         help=('start nodes per transaction '
+                               f'(default {COMPACT_BATCH_SIZE_DEFAULT})'),
+                         type=int,
+                         default=COMPACT_BATCH_SIZE_DEFAULT)
+
+    Import = Commands.add_parser('import',
+                                 help='bulk import departments, employees or projects from a CSV or JSONL file')
+
+    Import.add_argument('file',
+                        help='file to import, - for stdin')
+
+    Import.add_argument('-k',
+                        '--kind',
+                        action='store',
+                        dest='kind',
+                        help=f'what the file holds {IMPORT_KINDS}',
+                        choices=IMPORT_KINDS,
+                        required=True)
+
+    Import.add_argument('-f',
+                        '--format',
+                        action='store',
+                        dest='format',
+                        help=(f'file format {IMPORT_FORMATS} '
+                              '(default by the file extension)'),
+                        choices=IMPORT_FORMATS)
+
+    Import.add_argument('-b',
+                        '--batch-size',
+                        action='store',
+                        dest='batch_size',
+                        help=('rows per transaction '
+                              f'(default {IMPORT_BATCH_SIZE_DEFAULT})'),
+                        type=int,
+                        default=IMPORT_BATCH_SIZE_DEFAULT)
+
+    pars = Parser.parse_args(args)
+    # checked after parsing, so a WORKERS from the environment is covered too
+    if pars.workers < 0:
+        Parser.error(f'argument -w/--workers: must be 0 or more, got {pars.workers}')
 
-Pars = get_pars() 
\ No newline at end of file
+    return pars
@@ -0,0 +1,43 @@
+''' maintenance commands run through the graphr entry point '''
+
+from graphr.app.neo import Neo_client
+from graphr.logger import logger
+from graphr.importer import run_import
+
+
+def migrate_dates(neo, pars):
+    ''' converts string start dates to native dates in batches '''
+    converted = neo.migrate_started_dates(batch_size=pars.batch_size)
+    logger.info('Start date migration done, %s employees converted', converted)
+
+
+def compact(neo, pars):
+    ''' deletes duplicate relationships in batches '''
+    deleted = neo.compact_relationships(batch_size=pars.batch_size)
+    logger.info('Relationship compaction done, %s duplicates deleted', deleted)
+
+
+def import_file(neo, pars):
+    ''' streams a CSV or JSONL file into the graph in UNWIND batches '''
+    stats = run_import(neo, pars.file, pars.kind, fmt=pars.format, batch_size=pars.batch_size)
+    rate = stats['read'] / stats['seconds'] if stats['seconds'] else 0
+    logger.info('Import done: %s of %s %s written in %ss (%.0f rows/s), %s failed batches, %s lines skipped',
+                stats['written'], stats['read'], pars.kind, stats['seconds'], rate,
+                stats['failed_batches'], stats['skipped'])
+
+
+COMMANDS = {
+    'migrate-dates': migrate_dates,
+    'compact': compact,
+    'import': import_file,
+}
+
+
+def run_command(pars):
+    ''' runs the command picked on the command line, on a client of its own, no web app is built '''
+    neo = Neo_client(pars)
+    try:
+        neo.ensure_schema()
+        return COMMANDS[pars.command](neo, pars)
+    finally:
+        neo.close()
@@ -0,0 +1,95 @@
+''' streaming bulk import of CSV and JSONL files '''
+
+import csv
+import json
+import sys
+import time
+from itertools import islice
+from graphr.logger import logger
+
+# columns read per kind of node, anything else in the file is ignored
+FIELDS = {
+    'departments': ['name', 'description'],
+    'employees': ['id', 'surname', 'name', 'department', 'position', 'skills', 'note', 'project', 'started'],
+    'projects': ['id', 'name', 'client', 'department', 'description', 'since'],
+}
+FORMATS = ['csv', 'jsonl']
+
+
+def guess_format(path: str) -> str:
+    ''' file format from the extension, csv unless it says jsonl/ndjson '''
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_jsonl(fh, stats: dict):
+    '''
+    yields the objects of a JSONL file, skipping blank lines
+    a line that isn't a JSON object is logged with its number and counted
+    in stats['skipped'] instead of ending the import
+    '''
+    for number, line in enumerate(fh, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = e
+        if not isinstance(row, dict):
+            logger.warning('Skipped line %s, not a JSON object: %s', number, row)
+            stats['skipped'] += 1
+            continue
+        yield row
+
+
+def read_rows(fh, fmt: str, kind: str, stats: dict):
+    ''' yields rows of an open file one at a time, never reading it whole '''
+    fields = FIELDS[kind]
+    if fmt == 'csv':
+        rows = csv.DictReader(fh)
+    else:
+        rows = read_jsonl(fh, stats)
+    for row in rows:
+        yield {field: row.get(field) for field in fields}
+
+
+def batches(rows, size: int):
+    ''' splits an iterator of rows into lists of at most size rows '''
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_import(neo, path: str, kind: str, fmt: str=None, batch_size: int=500) -> dict:
+    '''
+    imports a file into the graph, one UNWIND transaction per batch
+    logs the progress and throughput after each batch, returns the totals
+    '''
+    fmt = fmt or guess_format(path)
+    write = {
+        'departments': neo.import_depts,
+        'employees': neo.import_employees,
+        'projects': neo.import_projects,
+    }[kind]
+    stats = {'read': 0, 'written': 0, 'skipped': 0, 'failed_batches': 0}
+    started = time.monotonic()
+
+    fh = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        for batch in batches(read_rows(fh, fmt, kind, stats), batch_size):
+            written = write(batch)
+            stats['read'] += len(batch)
+            if written is None:
+                stats['failed_batches'] += 1
+            else:
+                stats['written'] += written
+            elapsed = time.monotonic() - started
+            logger.info('Imported %s/%s %s, %.0f rows/s',
+                        stats['written'], stats['read'], kind, stats['read'] / elapsed if elapsed else 0)
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return stats
@@ -1,28 +1,130 @@
 ''' custom logger '''
 
+import atexit
+import json
 import logging
+import os
+import random
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from gevent import monkey
 import urllib3
 
+# the native primitives, whether gevent has patched the stdlib yet or not
+_start_new_thread = monkey.get_original('_thread', 'start_new_thread')
+_allocate_lock = monkey.get_original('_thread', 'allocate_lock')
+_RLock = monkey.get_original('_thread', 'RLock')
+_SimpleQueue = monkey.get_original('queue', 'SimpleQueue')
+
+# id of the request being handled, set by the app for every request
+request_id = ContextVar('request_id', default='-')
+
+TEXT_FORMAT = '%(asctime)s: GRAPHR %(request_id)s %(funcName)s, %(levelname)s: %(message)s'
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+
+class RequestIdFilter(logging.Filter):
+    ''' stamps records with the current request id, in the emitting greenlet '''
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    ''' lets only a rate fraction of the DEBUG records through, the rest pass untouched '''
+    def __init__(self, rate: float=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    ''' one JSON object per record '''
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'func': record.funcName,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    '''
+    queues the record as it is; the message and the traceback get formatted
+    by the listener, not in the calling greenlet
+    '''
+    def prepare(self, record):
+        return record
+
+
+class NativeQueueListener(QueueListener):
+    '''
+    a listener on a native thread; a threading.Thread would be a greenlet
+    once gevent patched the stdlib and would write to stderr on the hub
+    '''
+    def start(self):
+        self._pid = os.getpid()
+        self._done = _allocate_lock()
+        self._done.acquire()
+        _start_new_thread(self._run, ())
+
+    def _run(self):
+        try:
+            self._monitor()
+        finally:
+            self._done.release()
+
+    def stop(self):
+        ''' writes out the queued records and ends the thread '''
+        # a forked child has no thread to wait for until after_fork starts its own
+        if getattr(self, '_done', None) is not None and self._pid == os.getpid():
+            self.enqueue_sentinel()
+            self._done.acquire()
+            self._done = None
+
 
 class ConfLogger():
     '''
     set a logger with configured handlers and filters
+    the calling greenlet only filters and queues a record; formatting it and
+    writing to stderr happen on a native listener thread, off the gevent hub
     '''
-    def __init__(self, name, log_level=logging.DEBUG, log_verbose=False):
+    def __init__(self, name, log_level=logging.DEBUG, log_verbose=False,
+                 log_format='json', sample_rate=1.0):
+
+        stream = logging.StreamHandler()
+        # taken by the listener thread only, a gevent lock doesn't belong there
+        stream.lock = _RLock()
+        if log_format == 'json':
+            stream.setFormatter(JsonFormatter(datefmt=DATE_FORMAT))
+        else:
+            stream.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
 
-        handlers = [
-            logging.StreamHandler(),
-        ]
+        self.queue = _SimpleQueue()
+        self.handler = DeferredQueueHandler(self.queue)
+        self.handler.addFilter(SamplingFilter(sample_rate))
+        self.handler.addFilter(RequestIdFilter())
 
-        logging.basicConfig(
-            format='%(asctime)s: GRAPHR %(funcName)s, %(levelname)s:'
-            ' %(message)s',
-            level=log_level,
-            handlers=handlers,
-            datefmt='%m/%d/%Y %I:%M:%S %p')
+        root = logging.getLogger()
+        root.handlers = [self.handler]
+        root.setLevel(log_level)
+
+        self.listener = NativeQueueListener(self.queue, stream, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
 
         if not log_verbose:
             logging.getLogger('urllib3').setLevel(logging.CRITICAL)
+            logging.getLogger('neo4j').setLevel(max(log_level, logging.INFO))
             urllib3.disable_warnings()
 
         self.logger = logging.getLogger(name)
@@ -31,6 +133,49 @@ class ConfLogger():
         ''' getter '''
         return self.logger
 
+    def stop(self):
+        ''' writes out the queued records, the process is about to end '''
+        self.listener.stop()
+
+    def after_fork(self):
+        '''
+        a worker process writes its records through a listener of its own, on a
+        fresh queue; the records still queued at the fork are the parent's to write
+        '''
+        # the parent's listener thread doesn't come along, only its queue
+        self.queue = _SimpleQueue()
+        self.handler.queue = self.queue
+        self.listener = NativeQueueListener(self.queue, *self.listener.handlers, respect_handler_level=True)
+        self.listener.start()
+
+
+def setup_logging(pars) -> ConfLogger:
+    '''
+    configures the process logging from the parsed parameters, once;
+    until then records go to the default handlers of the logging module
+    '''
+    global cl
+    if cl is None:
+        cl = ConfLogger(__name__,
+                        log_level=pars.log_level,
+                        log_verbose=pars.log_verbose,
+                        log_format=pars.log_format,
+                        sample_rate=pars.log_sample_rate)
+
+    return cl
+
+
+def after_fork():
+    ''' to be called first thing in a forked worker process '''
+    if cl is not None:
+        cl.after_fork()
+
+
+def flush():
+    ''' writes out the queued records, to be called before os._exit skips atexit '''
+    if cl is not None:
+        cl.stop()
+
 
-cl = ConfLogger(__name__, log_level='DEBUG', log_verbose=False)
-logger = cl.get_logger()
+cl = None
+logger = logging.getLogger(__name__)
@@ -0,0 +1,162 @@
+''' in-process metrics registry with Prometheus text exposition '''
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# seconds, tuned for web requests and remote database round trips
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+class Counter:
+    ''' monotonically increasing value per label set '''
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, by: float=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + by
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    ''' cumulative buckets, sum and count per label set '''
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple=(), buckets: tuple=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        ''' observes the run time of the with block '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket', {**labels, 'le': le}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Gauge:
+    '''
+    value read at scrape time from a callback
+    the callback returns a number, or a list of (labels dict, number) pairs
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            if value is not None:
+                yield self.name, labels, value
+
+
+class CallbackCounter(Gauge):
+    '''
+    counter read at scrape time from a callback, for running totals kept
+    elsewhere, like the pool's; the callback returns what a Gauge's does
+    '''
+    kind = 'counter'
+
+
+class Registry:
+    ''' holds the metrics and renders them for a scrape '''
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        ''' adds metric, replacing one registered under the same name by an earlier app '''
+        self.metrics = [m for m in self.metrics if m.name != metric.name]
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple=(), buckets: tuple=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, callback) -> Gauge:
+        return self.register(Gauge(name, help, callback))
+
+    def callback_counter(self, name: str, help: str, callback) -> CallbackCounter:
+        return self.register(CallbackCounter(name, help, callback))
+
+    def render(self) -> str:
+        ''' all metrics in the Prometheus text format 0.0.4 '''
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {_escape(metric.help)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+QUERY_SECONDS = REGISTRY.histogram(
+    'graphr_query_seconds', 'Run time of Neo4j transaction functions', ('query', 'outcome'))
+QUERY_ROWS = REGISTRY.counter(
+    'graphr_query_rows_total', 'Records returned by Neo4j transaction functions', ('query',))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'graphr_request_seconds', 'Time spent in Flask route handlers', ('route', 'method', 'status'))
+TEMPLATE_SECONDS = REGISTRY.histogram(
+    'graphr_template_render_seconds', 'Jinja template render time', ('template',))
@@ -0,0 +1,198 @@
+''' pre-fork serving: one gevent server per CPU core on a shared listening socket '''
+
+import os
+import signal
+import socket
+import gevent
+from gevent import select
+from graphr.logger import logger, after_fork, flush
+from graphr.server import make_server
+
+LISTEN_BACKLOG = 2048
+# a new worker warms up before it takes traffic, this long at most in a rolling restart
+WORKER_READY_TIMEOUT = 120
+REAP_INTERVAL = 1
+
+
+def listen(address: str, port: int) -> socket.socket:
+    '''
+    the listening socket, bound once by the master and inherited by every worker,
+    so all of them accept from the same queue and a stopping worker drops nothing;
+    SO_REUSEPORT lets a second master bind the port during a redeploy
+    '''
+    family = socket.getaddrinfo(address, port, type=socket.SOCK_STREAM)[0][0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((address, port))
+    sock.listen(LISTEN_BACKLOG)
+
+    return sock
+
+
+def run_worker(pars, listener: socket.socket, ready_fd: int):
+    '''
+    a worker process: its own app, driver and pool, created after the fork;
+    it warms up before it accepts, reports ready to the master through ready_fd
+    and on SIGTERM stops accepting and finishes its requests in flight
+    '''
+    after_fork()
+    # Ctrl-C reaches the whole process group, the master does the stopping
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from graphr.app import create_app, warm_up
+
+    app = create_app(pars)
+    warm_up(app)
+    server = make_server(listener, app, pars)
+
+    def stop():
+        logger.info('Worker %s stopping, finishing requests in flight', os.getpid())
+        server.stop(timeout=pars.graceful_timeout)
+
+    gevent.signal_handler(signal.SIGTERM, stop)
+    server.start()
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    logger.info('Worker %s serving', os.getpid())
+    server.serve_forever()
+    app.extensions['graphr.neo'].close()
+
+
+class Master:
+    '''
+    forks --workers server processes and keeps them running
+    - a worker that dies is replaced
+    - SIGHUP replaces the workers one at a time, each only after its successor
+      is warm; the new ones import the app afresh, so a redeploy takes effect
+    - SIGTERM and SIGINT stop the workers gracefully, then the master
+    '''
+    def __init__(self, pars):
+        self.pars = pars
+        self.count = pars.workers or os.cpu_count()
+        self.workers = {}
+        self.retiring = set()
+        self.signal_handlers = []
+        self.listener = None
+        self.stopping = False
+        self.reload_requested = False
+
+    def run(self):
+        self.listener = listen(self.pars.app_listen_addr, self.pars.app_port)
+        logger.info('HTTP server listen %s:%s, master %s with %s workers',
+                    self.pars.app_listen_addr, self.pars.app_port, os.getpid(), self.count)
+        for _ in range(self.count):
+            self.spawn()
+
+        # the handlers only flag, forking happens in this loop, so a forked
+        # worker carries no other master greenlet along
+        self.signal_handlers = [
+            gevent.signal_handler(signal.SIGHUP, self.request_reload),
+            gevent.signal_handler(signal.SIGTERM, self.stop),
+            gevent.signal_handler(signal.SIGINT, self.stop),
+        ]
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap()
+            gevent.sleep(REAP_INTERVAL)
+
+        self.shutdown()
+
+    def spawn(self) -> int:
+        ''' forks a worker, returns its pid '''
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            # back to the default signal handling, the worker sets up its own
+            for handler in self.signal_handlers:
+                handler.cancel()
+            code = 0
+            try:
+                run_worker(self.pars, self.listener, ready_w)
+            except Exception as e:
+                logger.critical('Worker %s failed, exception: %s', os.getpid(), e)
+                code = 1
+            finally:
+                flush()
+                os._exit(code)
+
+        os.close(ready_w)
+        self.workers[pid] = ready_r
+        logger.info('Worker %s started', pid)
+
+        return pid
+
+    def wait_ready(self, pid: int, timeout: float) -> bool:
+        ''' True once the worker reported it is warm and accepting '''
+        ready_r = self.workers.get(pid)
+        if ready_r is None:
+            return False
+        readable, _, _ = select.select([ready_r], [], [], timeout)
+
+        return bool(readable) and os.read(ready_r, 1) == b'1'
+
+    def reap(self):
+        ''' collects exited workers and replaces the ones that were not asked to stop '''
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            ready_r = self.workers.pop(pid, None)
+            if ready_r is not None:
+                os.close(ready_r)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                logger.info('Worker %s stopped', pid)
+            elif not self.stopping:
+                logger.error('Worker %s died with status %s, replacing it', pid, status)
+                self.spawn()
+
+    def retire(self, pid: int):
+        ''' asks a worker to stop after its requests in flight '''
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reload(self):
+        ''' rolling restart, there are never fewer warm workers than configured '''
+        logger.info('Rolling restart of %s workers', len(self.workers))
+        for old in list(self.workers):
+            if self.stopping:
+                return
+            new = self.spawn()
+            if not self.wait_ready(new, WORKER_READY_TIMEOUT):
+                logger.error('Worker %s did not get ready in %ss, rolling restart aborted',
+                             new, WORKER_READY_TIMEOUT)
+                self.retire(new)
+                return
+            self.retire(old)
+        logger.info('Rolling restart done')
+
+    def request_reload(self):
+        self.reload_requested = True
+
+    def stop(self):
+        self.stopping = True
+
+    def shutdown(self):
+        ''' stops all workers gracefully, kills the ones still busy after the graceful timeout '''
+        logger.info('Stopping %s workers', len(self.workers))
+        for pid in list(self.workers):
+            self.retire(pid)
+        waited = 0
+        while self.workers and waited < self.pars.graceful_timeout + REAP_INTERVAL:
+            self.reap()
+            gevent.sleep(REAP_INTERVAL)
+            waited += REAP_INTERVAL
+        for pid in list(self.workers):
+            logger.warning('Worker %s still busy, killing it', pid)
+            os.kill(pid, signal.SIGKILL)
+        self.listener.close()
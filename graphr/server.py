@@ -2,21 +2,51 @@ from gevent import monkey
 monkey.patch_all()
 
 import logging
+import gevent
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer, LoggingLogAdapter
-from .app import app
-from graphr.argparser import Pars
-from graphr.logger import logger
+from graphr.argparser import get_pars
+from graphr.logger import logger, setup_logging
 
 
-def main():
-    '''start a http server'''
-
-    logger.info("HTTP server listen %s:%s", Pars.app_listen_addr,
-                Pars.app_port)
+def make_server(listener, app, pars) -> WSGIServer:
+    ''' gevent server of one process, handling at most --worker-connections requests at a time '''
     dlog = LoggingLogAdapter(logger, level=logging.DEBUG)
     errlog = LoggingLogAdapter(logger, level=logging.ERROR)
-    http_server = WSGIServer((Pars.app_listen_addr, Pars.app_port),
-                             app,
-                             log=dlog,
-                             error_log=errlog)
+
+    return WSGIServer(listener,
+                      app,
+                      spawn=Pool(pars.worker_connections),
+                      log=dlog,
+                      error_log=errlog)
+
+
+def serve(pars):
+    ''' single process server '''
+    # imported here, so pre-fork workers import the app fresh after the fork
+    from .app import create_app, warm_up
+
+    app = create_app(pars)
+    logger.info("HTTP server listen %s:%s", pars.app_listen_addr,
+                pars.app_port)
+    http_server = make_server((pars.app_listen_addr, pars.app_port), app, pars)
+    # listening right away answers /healthz, /readyz waits for the warm-up
+    http_server.start()
+    gevent.spawn(warm_up, app)
     http_server.serve_forever()
+
+
+def main():
+    '''start a http server, or run a maintenance command if one was given'''
+
+    pars = get_pars()
+    setup_logging(pars)
+    if pars.command:
+        from graphr.commands import run_command
+        return run_command(pars)
+
+    if pars.workers != 1:
+        from graphr.prefork import Master
+        return Master(pars).run()
+
+    serve(pars)
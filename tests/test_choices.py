@@ -0,0 +1,40 @@
+''' the form choices, cached under the graph version '''
+
+from types import SimpleNamespace
+
+import pytest
+
+from graphr.app.neo import Neo_client
+
+
+@pytest.fixture
+def neo(monkeypatch):
+    neo = Neo_client(SimpleNamespace())
+    neo.version = 1
+    neo.loads = 0
+
+    def load():
+        neo.loads += 1
+        return ['Sales']
+
+    monkeypatch.setattr(neo, 'get_graph_version', lambda: neo.version)
+    monkeypatch.setattr(neo, '_load_dept_choices', load)
+    return neo
+
+
+def test_choices_are_cached_until_the_version_moves(neo):
+    assert neo.get_dept_choices() == ['Sales']
+    assert neo.get_dept_choices() == ['Sales']
+    assert neo.loads == 1
+
+    # a write in another process bumped it
+    neo.version = 2
+    neo.get_dept_choices()
+    assert neo.loads == 2
+
+
+def test_choices_load_uncached_without_a_version(neo):
+    neo.version = None
+    neo.get_dept_choices()
+    neo.get_dept_choices()
+    assert neo.loads == 2
@@ -0,0 +1,17 @@
+''' node ID allocation '''
+
+import pytest
+
+from graphr.app.ids import IdAllocator, UlidAllocator
+
+
+def test_allocator_needs_new_id():
+    with pytest.raises(TypeError):
+        IdAllocator()
+
+
+def test_ulids_are_unique_and_increasing():
+    ids = UlidAllocator().new_ids(1000)
+
+    assert all(len(id) == 26 for id in ids)
+    assert ids == sorted(set(ids))
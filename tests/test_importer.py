@@ -0,0 +1,25 @@
+''' reading import files '''
+
+import io
+
+from graphr.importer import read_rows
+
+
+def test_jsonl_skips_blank_and_malformed_lines(caplog):
+    fh = io.StringIO('{"name": "Sales"}\n\n{"name": \n[1, 2]\n{"name": "IT", "id": "x"}\n')
+    stats = {'skipped': 0}
+
+    rows = list(read_rows(fh, 'jsonl', 'departments', stats))
+
+    assert rows == [{'name': 'Sales', 'description': None}, {'name': 'IT', 'description': None}]
+    assert stats['skipped'] == 2
+    assert 'Skipped line 3' in caplog.text and 'Skipped line 4' in caplog.text
+
+
+def test_csv_rows_keep_the_fields_of_the_kind():
+    fh = io.StringIO('name,client,extra\nApollo,ACME,1\n')
+
+    rows = list(read_rows(fh, 'csv', 'projects', {'skipped': 0}))
+
+    assert rows == [{'id': None, 'name': 'Apollo', 'client': 'ACME', 'department': None,
+                     'description': None, 'since': None}]
@@ -0,0 +1,130 @@
+''' keyset cursors, the page filling of the list views and the employee listing passes '''
+
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from graphr.app import paginate
+from graphr.app.neo import Neo_client
+
+
+@pytest.fixture
+def neo():
+    return Neo_client(SimpleNamespace())
+
+
+@pytest.fixture
+def app(neo):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.extensions['graphr.neo'] = neo
+    return app
+
+
+@pytest.mark.parametrize('values', [('Novak', '01H'), (None, '01H'), ('', '')])
+def test_cursor_round_trip(values):
+    cursor = Neo_client.encode_cursor(*values)
+    assert Neo_client.decode_cursor(cursor, 2) == list(values)
+
+
+@pytest.mark.parametrize('cursor', [None, '', 'not base64 json', Neo_client.encode_cursor('a', 'b', 'c')])
+def test_decode_cursor_without_a_valid_cursor(cursor):
+    assert Neo_client.decode_cursor(cursor, 2) == [None, None]
+
+
+def sort_key(e):
+    return (e.get('surname'), e['id'])
+
+
+def test_paginate_sets_the_cursor_of_the_last_row_shown(app):
+    rows = [{'id': str(i), 'surname': f's{i}'} for i in range(3)]
+    page_data = {}
+    with app.test_request_context('/employees?after=abc'):
+        assert paginate(page_data, 'employees', rows, 2, sort_key)
+
+    assert page_data['employees'] == rows[:2]
+    assert page_data['after'] == 'abc'
+    assert Neo_client.decode_cursor(page_data['next'], 2) == ['s1', '1']
+
+
+def test_paginate_last_page_has_no_cursor(app):
+    page_data = {}
+    with app.test_request_context('/employees'):
+        assert paginate(page_data, 'employees', [{'id': '1', 'surname': 'a'}], 2, sort_key)
+
+    assert page_data['next'] is None
+
+
+def test_paginate_failed_load(app):
+    page_data = {}
+    with app.test_request_context('/employees'):
+        assert not paginate(page_data, 'employees', None, 2, sort_key)
+
+    assert page_data['employees'] == [] and page_data['next'] is None
+
+
+class Record:
+    def __init__(self, employee):
+        self.employee = employee
+
+    def data(self):
+        return {'e': dict(self.employee), 'd': None, 'p': None}
+
+
+class FakeSession:
+    ''' answers the two listing passes from a list of employees '''
+    def __init__(self, employees):
+        self.employees = employees
+        self.calls = []
+
+    def read_transaction(self, fn, *args):
+        self.calls.append(fn.__name__)
+        if fn.__name__ == '_get_all_employees':
+            after_surname, after_id, limit = args
+            rows = sorted((e for e in self.employees if e.get('surname') is not None
+                           and (e['surname'], e['id']) > (after_surname, after_id)), key=sort_key)
+        else:
+            after_id, limit = args
+            rows = sorted((e for e in self.employees if e.get('surname') is None
+                           and e['id'] > after_id), key=lambda e: e['id'])
+        return [Record(e) for e in rows[:limit]]
+
+
+@pytest.fixture
+def listing(neo, monkeypatch):
+    employees = [{'id': '1'}, {'id': '2', 'surname': 'b'}, {'id': '3', 'surname': 'a'},
+                 {'id': '4'}, {'id': '5', 'surname': 'a'}]
+    session = FakeSession(employees)
+
+    @contextmanager
+    def fake_session(*args, **kwargs):
+        yield session
+
+    monkeypatch.setattr(neo, 'session', fake_session)
+    return session
+
+
+def test_listing_pages_reach_employees_without_a_surname(neo, listing):
+    seen, after = [], None
+    while True:
+        rows = neo.get_all_employees(after=after, limit=3)
+        page, more = rows[:2], len(rows) > 2
+        seen.extend(e['id'] for e in page)
+        if not more:
+            break
+        after = Neo_client.encode_cursor(*sort_key(page[-1]))
+
+    assert seen == ['3', '5', '2', '1', '4']
+
+
+def test_listing_skips_the_surname_pass_past_it(neo, listing):
+    rows = neo.get_all_employees(after=Neo_client.encode_cursor(None, '1'), limit=5)
+
+    assert [e['id'] for e in rows] == ['4']
+    assert listing.calls == ['_get_employees_without_surname']
+
+
+def test_listing_without_a_limit_returns_everyone(neo, listing):
+    assert [e['id'] for e in neo.get_all_employees()] == ['3', '5', '2', '1', '4']
@@ -0,0 +1,20 @@
+''' slow transaction logging '''
+
+from graphr.app.profiler import QueryProfiler
+
+
+def test_slow_transaction_logs_once_with_every_statement(caplog):
+    profiler = QueryProfiler(driver=None, slow_ms=100)
+    queries = [('MATCH (n) RETURN n', {'id': 'a'}), ('MATCH (m) RETURN m', {'ids': list(range(10))})]
+
+    profiler.observe('_get_page', 0.25, queries, write=False)
+
+    warnings = [r.getMessage() for r in caplog.records if r.levelname == 'WARNING']
+    assert warnings == ["Slow query _get_page took 250 ms, 2 statements, "
+                        "parameters: [{'id': 'a'}, {'ids': '<10 items>'}]"]
+
+
+def test_fast_transaction_is_not_logged(caplog):
+    QueryProfiler(driver=None, slow_ms=100).observe('_get_page', 0.01, [('RETURN 1', {})], write=False)
+
+    assert not caplog.records